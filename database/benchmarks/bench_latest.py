@@ -0,0 +1,70 @@
+"""Benchmark of the throughput of `/latest` on the response paths.
+
+Serves the same rows through a model validated against the `response_model`,
+the default JSON response of dict rows, and the fast paths the API uses,
+and reports the requests per second of each.
+
+Run from the database directory: `python -m benchmarks.bench_latest [rows] [requests]`
+"""
+import sys
+import time
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, Response
+from fastapi.testclient import TestClient
+
+from benchmarks.bench_rows import make_rows
+from models import OHLCResponse
+from queries import JOINED_OHLC_COLUMNS
+from responses import ORJSONResponse
+from utils import json_rows
+
+
+def make_app(rows: list[tuple]) -> FastAPI:
+    """Make an app serving the rows on a route per response path.
+
+    Every request builds the dict rows it needs, as the dict row factory would.
+    """
+    app = FastAPI()
+
+    def dict_rows() -> list[dict]:
+        return [dict(zip(JOINED_OHLC_COLUMNS, row)) for row in rows]
+
+    @app.get("/model", response_model=OHLCResponse)
+    async def model() -> OHLCResponse:
+        items = dict_rows()
+        return OHLCResponse(count=len(items), items=items)
+
+    @app.get("/json", response_model=OHLCResponse)
+    async def json() -> OHLCResponse:
+        items = dict_rows()
+        return JSONResponse({"count": len(items), "items": [
+            item | {"datetime": item["datetime"].isoformat()} for item in items
+        ]})
+
+    @app.get("/orjson", response_model=OHLCResponse)
+    async def orjson() -> OHLCResponse:
+        items = dict_rows()
+        return ORJSONResponse({"count": len(items), "items": items})
+
+    @app.get("/tuples", response_model=OHLCResponse)
+    async def tuples() -> OHLCResponse:
+        return Response(json_rows(JOINED_OHLC_COLUMNS, rows), media_type="application/json")
+
+    return app
+
+
+def main(count: int = 5000, requests: int = 50):
+    """Print the throughput of the response paths."""
+    client = TestClient(make_app(make_rows(count)))
+    for path in ("/model", "/json", "/orjson", "/tuples"):
+        client.get(path).raise_for_status()
+        start = time.perf_counter()
+        for _ in range(requests):
+            client.get(path)
+        elapsed = time.perf_counter() - start
+        print(f"{path:>8}: {requests / elapsed:8.1f} req/s ({count} rows)")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
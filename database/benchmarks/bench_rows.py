@@ -0,0 +1,82 @@
+"""Benchmark of the row paths of the large reads.
+
+Compares serializing dict rows through the pydantic models, zipping dict rows
+for orjson, serializing tuple rows straight to JSON bytes, and to an Arrow IPC stream
+when pyarrow is installed, in CPU time, peak memory and payload size.
+
+Run from the database directory: `python -m benchmarks.bench_rows [rows]`
+"""
+from datetime import datetime, timedelta
+import sys
+import timeit
+import tracemalloc
+
+import orjson
+
+import columnar
+from models import OHLCResponse
+from queries import JOINED_OHLC_COLUMNS
+from utils import json_rows
+
+
+def make_rows(count: int) -> list[tuple]:
+    """Generate tuple rows shaped like the joined OHLC rows."""
+    start = datetime(2021, 1, 1, 9, 30)
+    return [
+        (
+            start + timedelta(minutes=i), 1609459200 + i * 60, "AAPL", "Apple Inc.",
+            133.52, 135.99, 133.51, 135.98, float(140 + i), "yahoo", "Apple"
+        )
+        for i in range(count)
+    ]
+
+
+def model_path(rows: list[tuple]) -> bytes:
+    """Serialize the rows as the endpoints did, through dict rows and the models."""
+    items = [dict(zip(JOINED_OHLC_COLUMNS, row)) for row in rows]
+    return OHLCResponse(count=len(items), items=items).model_dump_json().encode()
+
+
+def dict_path(rows: list[tuple]) -> bytes:
+    """Serialize the rows zipped into dicts for orjson."""
+    return orjson.dumps({
+        "count": len(rows), "items": [dict(zip(JOINED_OHLC_COLUMNS, row)) for row in rows]
+    })
+
+
+def tuple_path(rows: list[tuple]) -> bytes:
+    """Serialize the tuple rows straight to JSON bytes."""
+    return json_rows(JOINED_OHLC_COLUMNS, rows)
+
+
+def arrow_path(rows: list[tuple]) -> bytes:
+    """Serialize the tuple rows to an Arrow IPC stream."""
+    return columnar.arrow_rows(JOINED_OHLC_COLUMNS, rows)
+
+
+def measure(func, rows: list[tuple], repeat: int = 5) -> tuple[float, int, int]:
+    """Get the best CPU time, the peak memory and the payload size of a path."""
+    seconds = min(timeit.repeat(lambda: func(rows), number=1, repeat=repeat))
+    tracemalloc.start()
+    size = len(func(rows))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak, size
+
+
+def main(count: int = 20000):
+    """Print the comparison of the row paths."""
+    rows = make_rows(count)
+    paths = [("models", model_path), ("dicts", dict_path), ("tuples", tuple_path)]
+    if columnar.available():
+        paths.append(("arrow", arrow_path))
+    for label, func in paths:
+        seconds, peak, size = measure(func, rows)
+        print(
+            f"{label:>8}: {seconds * 1000:8.2f} ms {peak / 2 ** 20:8.2f} MiB"
+            f" {size / 2 ** 20:8.2f} MiB payload ({count} rows)"
+        )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,69 @@
+"""Fan-out of the ingestion events to the subscribed clients, as Server-Sent Events."""
+from __future__ import annotations
+import asyncio
+from contextlib import contextmanager
+from typing import AsyncIterator, Iterator
+
+from metrics import METRICS
+from responses import dumps
+
+DROPPED_EVENTS = METRICS.counter(
+    "broadcast_dropped_events_total",
+    "Events dropped from the queues of slow subscribers.", ("channel",)
+)
+
+
+def sse(event: str, data: bytes, event_id: str = None) -> bytes:
+    """Format a Server-Sent Event."""
+    head = f"id: {event_id}\n" if event_id else ""
+    return f"{head}event: {event}\n".encode() + b"data: " + data + b"\n\n"
+
+
+class Broadcaster:
+    """Publishes events to every subscriber of a channel.
+
+    Events are encoded once, in a compact form and a form with the changed rows,
+    and the subscribers pick theirs. Every subscriber has a queue of `maxsize` events;
+    a subscriber that falls behind loses its oldest events instead of holding up
+    the publisher or growing its queue, since only the latest snapshot matters.
+    """
+    def __init__(self, channel: str, maxsize: int = 16, heartbeat: float = 15.0):
+        self.channel = channel
+        self.maxsize = maxsize
+        self.heartbeat = heartbeat
+        self.subscribers: set[asyncio.Queue[tuple[bytes, bytes]]] = set()
+
+    def __repr__(self) -> str:
+        return f"<[{self.__class__.__name__}] {self.channel}: {len(self.subscribers)} subscribers>"
+
+    @contextmanager
+    def subscribe(self) -> Iterator[asyncio.Queue[tuple[bytes, bytes]]]:
+        """Subscribe a queue to the events for the duration of the context."""
+        queue: asyncio.Queue[tuple[bytes, bytes]] = asyncio.Queue(self.maxsize)
+        self.subscribers.add(queue)
+        try:
+            yield queue
+        finally:
+            self.subscribers.discard(queue)
+
+    def publish(self, event: str, data: dict, rows: list[dict] = None, event_id: str = None):
+        """Publish an event, with the changed `rows` for the subscribers asking for them."""
+        compact = sse(event, dumps(data), event_id)
+        full = sse(event, dumps(data | {"items": rows or []}), event_id)
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+                DROPPED_EVENTS.inc(self.channel)
+            queue.put_nowait((compact, full))
+
+    async def stream(self, rows: bool = False) -> AsyncIterator[bytes]:
+        """Stream the events of a new subscription, with heartbeats while it is idle."""
+        with self.subscribe() as queue:
+            yield b": subscribed\n\n"
+            while True:
+                try:
+                    compact, full = await asyncio.wait_for(queue.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    yield b": heartbeat\n\n"
+                    continue
+                yield full if rows else compact
@@ -0,0 +1,85 @@
+"""In-process cache of the responses derived from the latest OHLC snapshot."""
+from __future__ import annotations
+from collections import OrderedDict
+import time
+from typing import Any, Awaitable, Callable, Hashable
+
+from metrics import METRICS
+
+CACHE_HITS = METRICS.counter("cache_hits_total", "Lookups served from the cache.", ("cache",))
+CACHE_MISSES = METRICS.counter("cache_misses_total", "Lookups which missed the cache.", ("cache",))
+
+
+class SnapshotCache:
+    """Caches values under the watermark of the latest ingested OHLC datetime.
+
+    Moving the watermark with `invalidate` drops every cached value, and a value
+    computed before the move is never stored under the new watermark.
+    The `ttl` bounds the staleness when the data changes elsewhere,
+    and the least recently used values are evicted beyond `maxsize`.
+    """
+    def __init__(self, name: str, ttl: float = 60.0, maxsize: int = 128):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.watermark: Any = None
+        self.generation = 0
+        self.entries: OrderedDict[tuple, tuple[float, Any]] = OrderedDict()
+
+    def __repr__(self) -> str:
+        return f"<[{self.__class__.__name__}] {self.name}: {len(self.entries)} entries>"
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get the value cached under the current watermark, counting the hit or miss."""
+        entry = self.entries.get((self.watermark, key))
+        if entry is None or entry[0] < time.monotonic():
+            CACHE_MISSES.inc(self.name)
+            return default
+        self.entries.move_to_end((self.watermark, key))
+        CACHE_HITS.inc(self.name)
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, generation: int = None):
+        """Cache a value computed in a `generation` of the cache, the current one by default.
+
+        Values computed before the last invalidation are discarded.
+        """
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        if generation is not None and generation != self.generation:
+            return
+        self.entries[(self.watermark, key)] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end((self.watermark, key))
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    async def get_or_set(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Get the cached value, or compute it with the `factory` and cache it.
+
+        Exceptions of the `factory` are raised without caching anything.
+        """
+        missing = object()
+        if (value := self.get(key, missing)) is not missing:
+            return value
+        generation = self.generation
+        value = await factory()
+        self.set(key, value, generation)
+        return value
+
+    def invalidate(self, watermark: Any = None):
+        """Move the watermark to the latest ingested datetime and drop the cached values."""
+        if watermark is not None:
+            self.watermark = watermark
+        self.generation += 1
+        self.entries.clear()
+
+    def get_stats(self) -> dict[str, float]:
+        """Get the number of entries, hits and misses of the cache."""
+        return {
+            "entries": len(self.entries),
+            "hits": CACHE_HITS.values[(self.name,)],
+            "misses": CACHE_MISSES.values[(self.name,)]
+        }
@@ -0,0 +1,67 @@
+"""Arrow IPC streams of the tuple rows, for clients loading them into columnar frames.
+
+pyarrow ships with the server's requirements. Installs without it answer the Arrow
+requests with a 406; `available` tells whether the streams can be built.
+"""
+from functools import cache
+import io
+from typing import AsyncIterator
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+
+def available() -> bool:
+    """Check whether pyarrow is installed."""
+    return pa is not None
+
+
+@cache
+def arrow_schema(columns: tuple[str, ...]) -> "pa.Schema":
+    """Get the Arrow schema of the columns, strings unless typed otherwise."""
+    types = {
+        "datetime": pa.timestamp("us"),
+        "timestamp": pa.int64(),
+        "open": pa.float64(),
+        "high": pa.float64(),
+        "low": pa.float64(),
+        "close": pa.float64(),
+        "volume": pa.float64()
+    }
+    return pa.schema([(column, types.get(column, pa.string())) for column in columns])
+
+
+def record_batch(columns: tuple[str, ...], rows: list[tuple]) -> "pa.RecordBatch":
+    """Build a record batch column by column from the tuple rows."""
+    schema = arrow_schema(columns)
+    values = list(zip(*rows)) or [()] * len(columns)
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(values, schema)],
+        schema=schema
+    )
+
+
+def arrow_rows(columns: tuple[str, ...], rows: list[tuple]) -> bytes:
+    """Serialize the tuple rows as an Arrow IPC stream of a single record batch."""
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, arrow_schema(columns)) as writer:
+        writer.write_batch(record_batch(columns, rows))
+    return sink.getvalue().to_pybytes()
+
+
+async def arrow_chunks(
+    columns: tuple[str, ...], chunks: AsyncIterator[list[tuple]]
+) -> AsyncIterator[bytes]:
+    """Serialize chunks of tuple rows as an Arrow IPC stream of a record batch per chunk."""
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, arrow_schema(columns)) as writer:
+        async for rows in chunks:
+            writer.write_batch(record_batch(columns, rows))
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    yield sink.getvalue()
@@ -0,0 +1,72 @@
+"""Content-Encoding negotiation and compression of the response bodies.
+
+Brotli is used when the brotli package is installed, gzip otherwise.
+"""
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Levels of the bodies compressed per request; the precompressed ones use the maximum.
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def supported() -> list[str]:
+    """Get the supported encodings, in the order of preference."""
+    return ["br", "gzip"] if brotli else ["gzip"]
+
+
+def negotiate(accept_encoding: str | None) -> str | None:
+    """Pick the supported encoding with the highest quality in an Accept-Encoding header."""
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        try:
+            quality = float(params.strip().removeprefix("q=")) if params else 1.0
+        except ValueError:
+            quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    ranked = [
+        (qualities.get(encoding, qualities.get("*", 0.0)), -index, encoding)
+        for index, encoding in enumerate(supported())
+    ]
+    quality, _, encoding = max(ranked)
+    return encoding if quality > 0 else None
+
+
+# pylint: disable=too-few-public-methods
+class StreamCompressor:
+    """Compresses a body chunk by chunk, flushing every chunk to the client."""
+    def __init__(self, encoding: str, level: int = None):
+        self.encoding = encoding
+        if encoding == "br":
+            self.compressor = brotli.Compressor(
+                quality=BROTLI_QUALITY if level is None else level
+            )
+        else:
+            self.compressor = zlib.compressobj(
+                GZIP_LEVEL if level is None else level, zlib.DEFLATED, zlib.MAX_WBITS | 16
+            )
+
+    def compress(self, data: bytes, final: bool = False) -> bytes:
+        """Compress a chunk, finishing the stream with the `final` one."""
+        if self.encoding == "br":
+            body = self.compressor.process(data)
+            return body + (self.compressor.finish() if final else self.compressor.flush())
+        body = self.compressor.compress(data)
+        return body + self.compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+def compress(content: bytes, encoding: str, level: int = None) -> bytes:
+    """Compress a whole body."""
+    return StreamCompressor(encoding, level).compress(content, final=True)
+
+
+def precompress(content: bytes, encoding: str) -> bytes:
+    """Compress a body which is served many times, at the maximum level."""
+    return compress(content, encoding, 11 if encoding == "br" else 9)
@@ -0,0 +1,80 @@
+"""Conditional GET support for the responses derived from the latest data."""
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Annotated, Awaitable, Callable
+
+from fastapi import Header, HTTPException
+
+from utils import logger_factory
+
+
+logger = logger_factory(__name__)
+
+
+def validators(watermark: datetime, version: int = 0) -> dict[str, str]:
+    """Get the ETag and Last-Modified headers of a response derived from data up to `watermark`.
+
+    The ETag tells apart the `version`s of the data at the same watermark, such as corrections.
+    Naive datetimes are taken as UTC. The ETag is weak, since the encoding of the body varies.
+    """
+    if watermark.tzinfo is None:
+        watermark = watermark.replace(tzinfo=timezone.utc)
+    return {
+        "ETag": f'W/"{watermark.timestamp():.6f}-{version}"',
+        "Last-Modified": format_datetime(watermark.astimezone(timezone.utc), usegmt=True),
+        "Cache-Control": "no-cache"
+    }
+
+
+def is_not_modified(
+    headers: dict[str, str], if_none_match: str | None, if_modified_since: str | None
+) -> bool:
+    """Check whether the client already holds the response of the `headers`.
+
+    `If-None-Match` takes precedence over `If-Modified-Since`, as in RFC 9110.
+    """
+    if if_none_match:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or headers["ETag"].removeprefix("W/") in tags
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        # The asctime form and the -0000 zone carry no offset, both are UTC.
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return parsedate_to_datetime(headers["Last-Modified"]) <= since
+    return False
+
+
+# pylint: disable=too-few-public-methods
+class ConditionalGet:
+    """Dependency answering conditional GETs from the `watermark` of a resource.
+
+    The watermark is the newest datetime the resource is derived from, along with
+    the version of the data, and is expected to be far cheaper to get than
+    the resource itself. Requests for
+    a representation the client already holds are answered with a 304 before
+    the endpoint runs; otherwise the headers to send along are returned.
+    """
+    def __init__(self, watermark: Callable[[], Awaitable[tuple[datetime, int] | None]]):
+        self.watermark = watermark
+
+    async def __call__(
+        self,
+        if_none_match: Annotated[str | None, Header()] = None,
+        if_modified_since: Annotated[str | None, Header()] = None
+    ) -> dict[str, str]:
+        try:
+            watermark = await self.watermark()
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.warning("Failed to get the watermark, skipping the validators.")
+            logger.warning(exc)
+            return {}
+        if watermark is None:
+            return {}
+        headers = validators(*watermark)
+        if is_not_modified(headers, if_none_match, if_modified_since):
+            raise HTTPException(status_code=304, headers=headers)
+        return headers
@@ -0,0 +1,90 @@
+"""Run mode, connectors and rate limits of the server, configured from the environment."""
+import os
+
+from psycopg.conninfo import make_conninfo
+
+from dbconn import DatabaseConnection
+from ratelimit import Limit, MemoryBuckets, RateLimiter, RedisBuckets, parse_limits
+import ratelimit
+from rcbconn import RabbitMQConnector
+from utils import fetch_password, logger_factory
+
+
+logger = logger_factory(__name__)
+
+# `api` serves the requests, `consumer` ingests the OHLC data from RabbitMQ
+# and `all` does both in the same process.
+RUN_MODES = ("api", "consumer", "all")
+RUN_MODE = os.getenv("RUN_MODE", "all").lower()
+if RUN_MODE not in RUN_MODES:
+    raise ValueError(f"RUN_MODE must be one of {', '.join(RUN_MODES)}, got {RUN_MODE!r}.")
+# Seconds between the consumptions of the OHLC queue.
+CONSUME_INTERVAL = int(os.getenv("CONSUME_INTERVAL", "120"))
+
+
+def database_connection() -> DatabaseConnection:
+    """Create the database connection."""
+    return DatabaseConnection(
+        user=os.getenv("DATABASE_USER", "postgres"),
+        password=fetch_password("DATABASE_PASSWORD"),
+        host=os.getenv("DATABASE_HOST", "localhost"),
+        port=int(os.getenv("DATABASE_PORT", "5432")),
+        database=os.getenv("DATABASE_NAME", "stocks"),
+        pool_min_size=int(os.getenv("DATABASE_POOL_MIN_SIZE", "1")),
+        pool_max_size=int(os.getenv("DATABASE_POOL_MAX_SIZE", "10")),
+        pool_timeout=float(os.getenv("DATABASE_POOL_TIMEOUT", "30")),
+        pool_check=os.getenv("DATABASE_POOL_CHECK", "true").lower() == "true",
+        partitioning=os.getenv("DATABASE_PARTITIONING", "true").lower() == "true",
+        partition_months_ahead=int(os.getenv("DATABASE_PARTITION_MONTHS_AHEAD", "2")),
+        pipeline_writes=os.getenv("DATABASE_PIPELINE_WRITES", "true").lower() == "true",
+        slow_query_seconds=float(os.getenv("DATABASE_SLOW_QUERY_SECONDS", "1")),
+        statement_timeout=float(os.getenv("DATABASE_STATEMENT_TIMEOUT", "0")),
+        statement_timeouts={
+            name.strip(): float(seconds)
+            for name, seconds in (
+                item.split("=")
+                for item in os.getenv("DATABASE_STATEMENT_TIMEOUTS", "").split(",")
+                if item.strip()
+            )
+        },
+        stream_idle_timeout=float(os.getenv("DATABASE_STREAM_IDLE_TIMEOUT", "60")),
+        replicas=[
+            make_conninfo(
+                user=os.getenv("DATABASE_USER", "postgres"),
+                password=fetch_password("DATABASE_PASSWORD"),
+                host=host.strip(),
+                port=os.getenv("DATABASE_PORT", "5432"),
+                dbname=os.getenv("DATABASE_NAME", "stocks")
+            )
+            for host in os.getenv("DATABASE_REPLICA_HOSTS", "").split(",")
+            if host.strip()
+        ],
+        replica_max_lag=float(os.getenv("DATABASE_REPLICA_MAX_LAG", "5")),
+        replica_check_interval=float(os.getenv("DATABASE_REPLICA_CHECK_INTERVAL", "5"))
+    )
+
+
+def rabbitmq_connector() -> RabbitMQConnector:
+    """Create the RabbitMQ connector."""
+    return RabbitMQConnector(
+        host=os.getenv("RABBITMQ_HOST", "localhost"),
+        port=int(os.getenv("RABBITMQ_PORT", "5672")),
+        username=os.getenv("RABBITMQ_USER", "guest"),
+        password=fetch_password("RABBITMQ_PASSWORD", default="guest")
+    )
+
+
+def rate_limiter() -> RateLimiter:
+    """Create the rate limiter, sharing its buckets over Redis if a URL is configured."""
+    redis_url = os.getenv("RATE_LIMIT_REDIS_URL")
+    if redis_url and not ratelimit.available():
+        logger.warning("redis is not installed, keeping the rate limits in process.")
+    default = os.getenv("RATE_LIMIT_DEFAULT", "120/60")
+    return RateLimiter(
+        limits=parse_limits(os.getenv("RATE_LIMITS", "insights=10/60")),
+        default=Limit.parse(default) if default else None,
+        backend=(
+            RedisBuckets(redis_url) if redis_url and ratelimit.available()
+            else MemoryBuckets(int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "10000")))
+        )
+    )
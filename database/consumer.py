@@ -0,0 +1,35 @@
+"""A consumer that ingests the OHLC data from RabbitMQ into the database.
+
+Runs apart from the API workers, which then scale without competing for the queue.
+"""
+import asyncio
+
+from utils import logger_factory
+from config import CONSUME_INTERVAL, database_connection, rabbitmq_connector
+from ingestion import ingest_ohlc
+
+
+logger = logger_factory("Consumer")
+
+
+async def consume():
+    """Consume the OHLC queue until cancelled."""
+    db_handler = database_connection()
+    rmq_handler = rabbitmq_connector()
+
+    async def ingest(ohlc: list[dict]) -> dict[str, int] | None:
+        response, _ = await ingest_ohlc(db_handler, ohlc)
+        return response
+
+    await db_handler.connect()
+    await rmq_handler.connect()
+    logger.info("Consuming the OHLC queue every %s seconds.", CONSUME_INTERVAL)
+    try:
+        await rmq_handler.periodic_consume("ohlc", ingest, CONSUME_INTERVAL)
+    finally:
+        await rmq_handler.disconnect()
+        await db_handler.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(consume())
@@ -1,15 +1,32 @@
 """Creates the Database Connection and Exposes it."""
+# pylint: disable=too-many-lines
 from __future__ import annotations
 import asyncio
+from contextlib import (
+    AbstractAsyncContextManager, asynccontextmanager, contextmanager, nullcontext, suppress
+)
+from datetime import date, datetime
+from itertools import count
 import sys
-from typing import TYPE_CHECKING
+import time
+from typing import TYPE_CHECKING, AsyncIterator, Iterable, Iterator, Sequence
 
 import psycopg
-from psycopg.rows import dict_row
+from psycopg.conninfo import conninfo_to_dict
+from psycopg.rows import dict_row, tuple_row
+from psycopg.types.numeric import FloatLoader
 from psycopg.pq import ExecStatus
-from psycopg.sql import SQL, Identifier
+from psycopg.sql import SQL, Identifier, Literal
+from psycopg_pool import AsyncConnectionPool
 
 from base_connector import BaseConnector
+from metrics import METRICS
+from queries import (
+    BUMP_SNAPSHOT_VERSION, NOTIFY, PARTITIONING_LOCK, REPLICATION_LAG, ROLLUP_RESOLUTIONS,
+    SCHEMA_STATEMENTS, SET_STATEMENT_TIMEOUT, SET_STREAM_TIMEOUTS, STATEMENTS, rollup_refresh,
+    snapshot_refresh
+)
+from statements import Statement
 from utils import logger_factory, ensure_session
 
 if TYPE_CHECKING:
@@ -19,18 +36,153 @@ if TYPE_CHECKING:
 
 logger = logger_factory(__name__)
 
+QUERY_DURATION = METRICS.histogram(
+    "db_query_duration_seconds", "Latency of the database queries, connection checkout included.",
+    ("query",)
+)
+QUERY_ROWS = METRICS.counter(
+    "db_query_rows_total", "Rows fetched or written by the database queries.", ("query",)
+)
+QUERY_ERRORS = METRICS.counter(
+    "db_query_errors_total", "Database queries which failed.", ("query",)
+)
 
-# pylint: disable=too-many-arguments
+# Column types of the temporary tables which are bulk loaded with a binary COPY.
+# Prices and volumes are staged as float8 and cast to the target types by the merge.
+OHLC_STAGING_COLUMNS = {
+    "datetime": "timestamp",
+    "timestamp": "int8",
+    "ticker": "text",
+    "name": "text",
+    "open": "float8",
+    "high": "float8",
+    "low": "float8",
+    "close": "float8",
+    "volume": "float8",
+    "source": "text"
+}
+COMPANY_STAGING_COLUMNS = {
+    "ticker": "text",
+    "name": "text",
+    "website": "text",
+    "country": "text",
+    "logo": "text",
+    "industry": "text",
+    "exchange": "text",
+    "phone": "text",
+    "market_cap": "int8",
+    "num_shares": "int8"
+}
+COPY_CASTERS = {
+    "timestamp": lambda value: (
+        value if isinstance(value, datetime)
+        else datetime.fromisoformat(value)
+    ),
+    "int8": int,
+    "float8": float,
+    "text": str
+}
+OHLC_KEY = ("ticker", "datetime")
+OHLC_DATETIME_INDEX = list(OHLC_STAGING_COLUMNS).index("datetime")
+
+
+def month_start(value: datetime | date) -> date:
+    """Get the first day of the month of a datetime."""
+    return date(value.year, value.month, 1)
+
+
+def next_month(month: date) -> date:
+    """Get the first day of the month after a month start."""
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+# pylint: disable=too-few-public-methods
+class Replica:
+    """A read replica along with its last measured replication lag and when it was measured."""
+    def __init__(self, conn_str: str):
+        self.conn_str = conn_str
+        self.host = conninfo_to_dict(conn_str).get("host", "localhost")
+        self.session: psycopg.AsyncConnection | AsyncConnectionPool = None
+        self.lag = float("inf")
+        self.checked_at = float("-inf")
+
+    def __repr__(self) -> str:
+        return f"<[{self.__class__.__name__}] {self.host}>"
+
+
+# pylint: disable=too-many-arguments, too-many-locals, too-many-instance-attributes, too-many-public-methods
 class DatabaseConnection(BaseConnector):
-    """Database Connection Class."""
+    """Database Connection Class.
+
+    A `pool_max_size` of 0 keeps a single shared connection, anything above it
+    switches to a connection pool where every query checks out its own connection.
+    Transactions never run on the shared connection, where the concurrent queries
+    would land in them; without a pool they take turns on a connection of their own.
+
+    Every connection bounds its statements by `statement_timeout`, set once as it connects.
+    `statement_timeouts` override it for the reads of a query name, on pooled connections
+    only, since the shared connection has no room for the setting of a single query.
+    Cancelling the awaiting task cancels the query on the server.
+
+    Streams hold a transaction open on a pooled connection of their own, closed by the server
+    once the consumer stops fetching for `stream_idle_timeout` seconds. Without a pool,
+    they fetch everything at once and hand it out in chunks.
+
+    Read-only queries are spread over the `replicas` DSNs, round-robin, as long as
+    their replication lag stays within `replica_max_lag` seconds. They fall back to
+    the primary otherwise. Writes and read-after-write queries always go to the primary.
+    The lags are measured in the background every `replica_check_interval` seconds.
+    """
     def __init__(
         self, user: str, password: str,
         host: str, port: str,
-        database: str
+        database: str,
+        pool_min_size: int = 1,
+        pool_max_size: int = 0,
+        pool_timeout: float = 30.0,
+        pool_check: bool = True,
+        partitioning: bool = True,
+        partition_months_ahead: int = 2,
+        pipeline_writes: bool = True,
+        slow_query_seconds: float = 1.0,
+        statement_timeout: float = 0,
+        statement_timeouts: dict[str, float] = None,
+        stream_idle_timeout: float = 60.0,
+        replicas: list[str] = None,
+        replica_max_lag: float = 5.0,
+        replica_check_interval: float = 5.0
     ):
         super().__init__()
-        self.session: psycopg.AsyncConnection
+        self.session: psycopg.AsyncConnection | AsyncConnectionPool
         self.conn_str = f"postgresql://{user}:{password}@{host}:{port}/{database}"
+        self.pooled = pool_max_size > 0
+        self.pool_min_size = min(pool_min_size, pool_max_size)
+        self.pool_max_size = pool_max_size
+        self.pool_timeout = pool_timeout
+        self.pool_check = pool_check
+        self._cursor_ids = count()
+        self.partitioning = partitioning
+        self.partition_months_ahead = partition_months_ahead
+        # Default of the writes which can opt in to pipeline mode.
+        self.pipeline_writes = pipeline_writes
+        self.slow_query_seconds = slow_query_seconds
+        # Timeouts in seconds by query name, 0 disables them.
+        self.statement_timeout = statement_timeout
+        self.statement_timeouts = statement_timeouts or {}
+        self.stream_idle_timeout = stream_idle_timeout
+        # Whether ohlc is known to be partitioned, and the months with a known partition.
+        self._partitioned = False
+        self._partitions: set[date] = set()
+        self.replicas = [Replica(conn_str) for conn_str in replicas or []]
+        self.replica_max_lag = replica_max_lag
+        self.replica_check_interval = replica_check_interval
+        self._replica_ids = count()
+        self._replica_monitor: asyncio.Task | None = None
+        # Latest OHLC datetime written by this process.
+        self.ohlc_watermark: datetime | None = None
+        # Connection of the transactions when there is no pool, one transaction at a time.
+        self._write_session: psycopg.AsyncConnection | None = None
+        self._write_lock = asyncio.Lock()
         if sys.platform == "win32":
             asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
@@ -39,374 +191,824 @@ class DatabaseConnection(BaseConnector):
         logger.info("Connecting to database...")
         while not self.session:
             try:
-                self.session = await psycopg.AsyncConnection.connect(
-                    self.conn_str, row_factory=dict_row,
-                    autocommit=True
-                )
+                self.session = await self._open(self.conn_str, "db-server")
                 logger.success("Connected to the Database.")
             except psycopg.errors.Error:
                 logger.warning("Failed to connect to Database. Retrying in 10 seconds...")
                 await asyncio.sleep(10)
+        if self.partitioning:
+            await self.prepare_partitions()
+        await self.prepare_schema()
+        if self.replicas:
+            await self._check_replicas()
+            self._replica_monitor = asyncio.create_task(self._monitor_replicas())
+
+    async def _open(
+        self, conn_str: str, name: str
+    ) -> psycopg.AsyncConnection | AsyncConnectionPool:
+        """Open a pool or a single connection, depending on the pool mode."""
+        if self.pooled:
+            return await self._open_pool(conn_str, name)
+        return await psycopg.AsyncConnection.connect(conn_str, **self._connect_kwargs())
+
+    def _connect_kwargs(self) -> dict:
+        """Get the connection parameters, with the default statement timeout as an option."""
+        kwargs = {"row_factory": dict_row, "autocommit": True}
+        if self.statement_timeout:
+            kwargs["options"] = f"-c statement_timeout={int(self.statement_timeout * 1000)}"
+        return kwargs
+
+    async def prepare_schema(self):
+        """Create the indexes and tables the queries rely on, if they are missing."""
+        async with self._acquire() as conn, conn.cursor() as cursor:
+            for statement in SCHEMA_STATEMENTS:
+                try:
+                    await cursor.execute(statement)
+                except psycopg.errors.Error as exp:
+                    logger.warning("Failed to prepare the schema.")
+                    logger.warning(exp)
+
+    async def prepare_partitions(self):
+        """Partition the ohlc table by month and create the partitions of the coming months.
+
+        An unpartitioned ohlc table is converted once, under an advisory lock
+        so that concurrent workers don't race each other.
+        """
+        today = datetime.utcnow()
+        months = [month_start(today)]
+        for _ in range(self.partition_months_ahead):
+            months.append(next_month(months[-1]))
+        try:
+            async with self._exclusive() as conn:
+                if not await self._is_partitioned(conn):
+                    async with conn.transaction(), conn.cursor() as cursor:
+                        await cursor.execute(PARTITIONING_LOCK)
+                        # Moving the rows may well outlast the timeout of the queries.
+                        await cursor.execute("SET LOCAL statement_timeout = 0")
+                        if not await self._is_partitioned(conn):
+                            await self._partition_ohlc(conn)
+                self._partitioned = True
+                await self.ensure_partitions(conn, months)
+        except psycopg.errors.Error as exp:
+            logger.warning("Failed to prepare the ohlc partitions.")
+            logger.warning(exp)
+
+    @staticmethod
+    async def _is_partitioned(conn: psycopg.AsyncConnection) -> bool:
+        """Check if the ohlc table is partitioned."""
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                "SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass",
+                ("ohlc",)
+            )
+            return bool(await cursor.fetchone())
+
+    async def _partition_ohlc(self, conn: psycopg.AsyncConnection):
+        """Move the rows of an unpartitioned ohlc table into monthly partitions."""
+        logger.info("Partitioning the ohlc table by month...")
+        async with conn.cursor() as cursor:
+            for statement in (
+                "ALTER TABLE ohlc RENAME TO ohlc_unpartitioned",
+                "ALTER INDEX ohlc_pkey RENAME TO ohlc_unpartitioned_pkey",
+                """
+                CREATE TABLE ohlc (LIKE ohlc_unpartitioned INCLUDING DEFAULTS)
+                    PARTITION BY RANGE (datetime)
+                """,
+                """
+                ALTER TABLE ohlc
+                    ADD PRIMARY KEY (ticker, datetime),
+                    ADD FOREIGN KEY (ticker) REFERENCES tickers(ticker)
+                """,
+                "SELECT MIN(datetime) AS first, MAX(datetime) AS last FROM ohlc_unpartitioned"
+            ):
+                await cursor.execute(statement)
+            bounds = await cursor.fetchone()
+        if bounds and bounds["first"]:
+            months = [month_start(bounds["first"])]
+            while months[-1] < month_start(bounds["last"]):
+                months.append(next_month(months[-1]))
+            await self.ensure_partitions(conn, months)
+        async with conn.cursor() as cursor:
+            await cursor.execute("INSERT INTO ohlc SELECT * FROM ohlc_unpartitioned")
+            logger.success("Moved %s rows into the ohlc partitions.", cursor.rowcount)
+            await cursor.execute("DROP TABLE ohlc_unpartitioned")
+
+    async def ensure_partitions(
+        self, conn: psycopg.AsyncConnection,
+        datetimes: Iterable[datetime | date]
+    ):
+        """Create the monthly ohlc partitions covering the datetimes, if they are missing.
+
+        They are created under the partitioning lock, one worker at a time,
+        since concurrent creations of the same partition fail.
+        """
+        missing = sorted({month_start(value) for value in datetimes} - self._partitions)
+        if not missing:
+            return
+        async with conn.transaction(), conn.cursor() as cursor:
+            await cursor.execute(PARTITIONING_LOCK)
+            for month in missing:
+                await cursor.execute(
+                    SQL("""
+                        CREATE TABLE IF NOT EXISTS {partition}
+                            PARTITION OF {ohlc}
+                            FOR VALUES FROM ({lower}) TO ({upper})
+                    """).format(
+                        partition=Identifier(f"ohlc_y{month:%Y}m{month:%m}"),
+                        ohlc=Identifier("ohlc"),
+                        lower=Literal(month),
+                        upper=Literal(next_month(month))
+                    )
+                )
+        self._partitions.update(missing)
+        logger.info(
+            "Prepared the ohlc partitions of %s.", ", ".join(f"{month:%Y-%m}" for month in missing)
+        )
+
+    async def _open_pool(self, conn_str: str, name: str) -> AsyncConnectionPool:
+        """Open a connection pool and wait until `pool_min_size` connections are ready."""
+        pool = AsyncConnectionPool(
+            conn_str,
+            min_size=self.pool_min_size,
+            max_size=self.pool_max_size,
+            timeout=self.pool_timeout,
+            kwargs=self._connect_kwargs(),
+            check=AsyncConnectionPool.check_connection if self.pool_check else None,
+            name=name,
+            open=False
+        )
+        try:
+            await pool.open(wait=True, timeout=self.pool_timeout)
+        except psycopg.errors.Error:
+            await pool.close()
+            raise
+        logger.info(
+            "Opened a connection pool of %s-%s connections.",
+            self.pool_min_size, self.pool_max_size
+        )
+        return pool
+
+    @asynccontextmanager
+    async def _acquire(self, readonly: bool = False) -> AsyncIterator[psycopg.AsyncConnection]:
+        """Check out a connection from the pool, or share the single connection.
+
+        Read-only checkouts go to a replica within the lag threshold, if any.
+        """
+        session = self.session
+        if readonly and (replica := self._pick_replica()):
+            session = replica.session
+        if self.pooled:
+            async with session.connection(timeout=self.pool_timeout) as conn:
+                yield conn
+        else:
+            yield session
+
+    @asynccontextmanager
+    async def _exclusive(self) -> AsyncIterator[psycopg.AsyncConnection]:
+        """Check out a connection which no other query shares, for transactions and pipelines.
+
+        Pooled checkouts are exclusive already. Without a pool, the callers
+        take turns on a write connection of their own, opened on first use.
+        """
+        if self.pooled:
+            async with self._acquire() as conn:
+                yield conn
+            return
+        async with self._write_lock:
+            if self._write_session is None or self._write_session.closed:
+                self._write_session = await self._open(self.conn_str, "db-writer")
+            yield self._write_session
+
+    def _pick_replica(self) -> Replica | None:
+        """Pick the next replica within the lag threshold, round-robin.
+
+        Lags measured over two check intervals ago are stale, in case the checks are stuck.
+        """
+        measured_since = time.monotonic() - 2 * self.replica_check_interval
+        start = next(self._replica_ids)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if replica.checked_at >= measured_since and replica.lag <= self.replica_max_lag:
+                return replica
+        return None
+
+    async def _monitor_replicas(self):
+        """Measure the replication lags every `replica_check_interval`, until cancelled."""
+        while True:
+            await asyncio.sleep(self.replica_check_interval)
+            await self._check_replicas()
+
+    async def _check_replicas(self):
+        """Measure the replication lags of every replica at once."""
+        await asyncio.gather(*(self._check_lag(replica) for replica in self.replicas))
+
+    async def _check_lag(self, replica: Replica) -> float:
+        """Measure the replication lag of a replica.
+
+        Unreachable replicas count as infinitely lagging. Their single connection
+        is dropped and reopened on the next check, where a pool recovers on its own.
+        """
+        try:
+            if replica.session is None:
+                replica.session = await self._open(
+                    replica.conn_str, f"db-replica-{self.replicas.index(replica)}"
+                )
+            if self.pooled:
+                async with replica.session.connection(timeout=self.pool_timeout) as conn:
+                    row = await (await conn.execute(REPLICATION_LAG)).fetchone()
+            else:
+                row = await (await replica.session.execute(REPLICATION_LAG)).fetchone()
+            lag = float("inf") if row["lag"] is None else float(row["lag"])
+        except psycopg.errors.Error as exp:
+            logger.warning("Failed to check the replication lag of %s.", replica.host)
+            logger.warning(exp)
+            lag = float("inf")
+            if not self.pooled and replica.session is not None:
+                session, replica.session = replica.session, None
+                await session.close()
+        if lag > self.replica_max_lag >= replica.lag:
+            logger.warning(
+                "Replica %s lags by %ss, falling back to the primary.", replica.host, lag
+            )
+        replica.lag = lag
+        replica.checked_at = time.monotonic()
+        return lag
+
+    def get_replica_stats(self) -> dict[str, float]:
+        """Get the last measured replication lag of every replica."""
+        return {replica.host: replica.lag for replica in self.replicas}
+
+    def _pipeline(
+        self, conn: psycopg.AsyncConnection, enabled: bool | None = None
+    ) -> AbstractAsyncContextManager:
+        """Enter pipeline mode, where the statements are sent without waiting for their results
+        and flushed in a single round trip on exit.
+
+        `enabled` defaults to `pipeline_writes`. COPY is not allowed within a pipeline.
+        """
+        if enabled is None:
+            enabled = self.pipeline_writes
+        if enabled and psycopg.AsyncPipeline.is_supported():
+            return conn.pipeline()
+        return nullcontext()
+
+    def get_pool_stats(self) -> dict[str, int]:
+        """Get the connection pool statistics."""
+        if not self.pooled or self.session is None:
+            return {}
+        return self.session.get_stats()
+
+    @staticmethod
+    def get_statement_stats() -> dict[str, dict[str, int]]:
+        """Get the prepare and execution counts of the registered statements."""
+        return STATEMENTS.get_stats()
 
     async def disconnect(self):
         """Disconnect from the database."""
         logger.info("Disconnecting from database...")
+        if self._replica_monitor is not None:
+            self._replica_monitor.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._replica_monitor
+            self._replica_monitor = None
+        for replica in self.replicas:
+            if replica.session is not None:
+                await replica.session.close()
+                replica.session = None
+        if self._write_session is not None:
+            await self._write_session.close()
+            self._write_session = None
         await super().disconnect()
 
+    @staticmethod
+    async def _execute(
+        conn: psycopg.AsyncConnection, cursor: psycopg.AsyncCursor,
+        query: Statement | Composed | str, *args
+    ):
+        """Execute a query, preparing it server-side if it is a registered statement."""
+        if isinstance(query, Statement):
+            await cursor.execute(query.query, *args, prepare=True)
+            query.record(conn)
+        else:
+            await cursor.execute(query, *args)
+
+    @contextmanager
+    def _instrument(self, name: str) -> Iterator[dict[str, int]]:
+        """Record the latency, row count and failure of a query under its name.
+
+        The caller sets the `rows` of the yielded dict. Queries slower than
+        `slow_query_seconds` are logged.
+        """
+        stats = {"rows": 0}
+        started = time.perf_counter()
+        try:
+            yield stats
+        except psycopg.errors.Error:
+            QUERY_ERRORS.inc(name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            QUERY_DURATION.observe(name, value=elapsed)
+            QUERY_ROWS.inc(name, amount=stats["rows"])
+            if elapsed >= self.slow_query_seconds:
+                logger.warning("Slow query %s took %.3fs.", name, elapsed)
+
+    def _statement_timeout(
+        self, conn: psycopg.AsyncConnection, name: str
+    ) -> AbstractAsyncContextManager:
+        """Bound the statements of the block by the timeout of the query name, if it has its own.
+
+        The override only lasts for a transaction, which is pipelined along with the statements
+        of the block and committed on exit, so their results are fetched after the block.
+        The default timeout of the connection applies on the shared connection.
+        """
+        timeout = self.statement_timeouts.get(name, self.statement_timeout)
+        if not self.pooled or timeout == self.statement_timeout:
+            return nullcontext()
+        return self._timeout_transaction(conn, name)
+
+    @asynccontextmanager
+    async def _timeout_transaction(
+        self, conn: psycopg.AsyncConnection, name: str
+    ) -> AsyncIterator[None]:
+        """Run the block in a pipelined transaction bounded by the timeout of the query name."""
+        async with conn.pipeline(), conn.transaction():
+            await conn.execute(
+                SET_STATEMENT_TIMEOUT, (str(int(self.statement_timeouts[name] * 1000)),)
+            )
+            yield
+
+    @staticmethod
+    def _query_name(query: Statement | Composed | str, name: str | None) -> str:
+        """Name a query after its statement, unless it is named explicitly."""
+        if name is None:
+            return query.name if isinstance(query, Statement) else "adhoc"
+        return name
+
+    @staticmethod
+    def _cursor(
+        conn: psycopg.AsyncConnection, tuples: bool = False, **kwargs
+    ) -> psycopg.AsyncCursor:
+        """Open a cursor, fetching tuple rows with numerics loaded as floats if `tuples`.
+
+        Tuple rows skip the per-row dicts and Decimals, for reads which are serialized
+        straight to JSON against a fixed column list.
+        """
+        if not tuples:
+            return conn.cursor(**kwargs)
+        cursor = conn.cursor(row_factory=tuple_row, **kwargs)
+        cursor.adapters.register_loader("numeric", FloatLoader)
+        return cursor
+
     @ensure_session
-    async def fetchall(self, query: Composed | str, *args) -> list[dict]:
-        """Fetch a query."""
-        async with self.session.cursor() as cursor:
-            try:
-                await cursor.execute(query, *args)
-                logger.info("Fetched all rows.")
-                return await cursor.fetchall()
-            except psycopg.errors.Error as exp:
-                logger.error(exp)
-                return []
+    async def fetchall(
+        self, query: Statement | Composed | str, *args,
+        readonly: bool = False, name: str = None, tuples: bool = False
+    ) -> list[dict] | list[tuple]:
+        """Fetch a query, from a replica if it is `readonly`, as tuple rows if `tuples`."""
+        name = self._query_name(query, name)
+        try:
+            with self._instrument(name) as stats:
+                async with self._acquire(readonly) as conn, self._cursor(conn, tuples) as cursor:
+                    async with self._statement_timeout(conn, name):
+                        await self._execute(conn, cursor, query, *args)
+                    rows = await cursor.fetchall()
+                    stats["rows"] = len(rows)
+                    logger.debug("Fetched %s rows of %s.", len(rows), name)
+                    return rows
+        except psycopg.errors.Error as exp:
+            logger.error(exp)
+            return []
 
     @ensure_session
-    async def fetchone(self, query: Composed | str, *args) -> dict:
-        """Fetch a single row."""
-        async with self.session.cursor() as cursor:
-            try:
-                await cursor.execute(query, *args)
-                logger.info("Fetched a single row.")
-                return await cursor.fetchone()
-            except psycopg.errors.Error as exp:
-                logger.error(exp)
-                return None
+    async def fetchone(
+        self, query: Statement | Composed | str, *args,
+        readonly: bool = False, name: str = None
+    ) -> dict:
+        """Fetch a single row, from a replica if it is `readonly`."""
+        name = self._query_name(query, name)
+        try:
+            with self._instrument(name) as stats:
+                async with self._acquire(readonly) as conn, conn.cursor() as cursor:
+                    async with self._statement_timeout(conn, name):
+                        await self._execute(conn, cursor, query, *args)
+                    row = await cursor.fetchone()
+                    stats["rows"] = int(row is not None)
+                    logger.debug("Fetched a single row of %s.", name)
+                    return row
+        except psycopg.errors.Error as exp:
+            logger.error(exp)
+            return None
 
     @ensure_session
-    async def insert(self, query: Composed | str, *args) -> bool:
-        """Insert a single or multiple rows."""
-        async with self.session.cursor() as cursor:
-            try:
-                values = args[0]
-                if not values:
-                    return False
-                if isinstance(values[0], list):
-                    await cursor.executemany(query, values, returning=True)
-                else:
-                    await cursor.execute(query, values)
-                logger.success("Inserted %s rows.", len(values))
-                return (
-                    cursor.pgresult
-                    and 'OK' in ExecStatus(cursor.pgresult.status).name
+    async def insert(
+        self, query: Statement | Composed | str, *args,
+        pipeline: bool = False, name: str = None
+    ) -> bool:
+        """Insert a single or multiple rows, optionally in pipeline mode."""
+        values = args[0]
+        if not values:
+            return False
+        name = self._query_name(query, name)
+        try:
+            with self._instrument(name) as stats:
+                acquire = self._exclusive() if pipeline else self._acquire()
+                async with acquire as conn, conn.cursor() as cursor:
+                    async with self._pipeline(conn, pipeline):
+                        if isinstance(values[0], list):
+                            await cursor.executemany(query, values, returning=True)
+                        else:
+                            await self._execute(conn, cursor, query, values)
+                    stats["rows"] = len(values) if isinstance(values[0], list) else 1
+                    logger.success("Inserted %s rows.", stats["rows"])
+                    return (
+                        cursor.pgresult
+                        and 'OK' in ExecStatus(cursor.pgresult.status).name
+                    )
+        except psycopg.errors.Error as exp:
+            logger.error(exp)
+            return False
+
+    @ensure_session
+    async def execute_batch(
+        self, statements: Iterable[tuple[Statement | Composed | str, Sequence | None]],
+        name: str = "batch"
+    ) -> bool:
+        """Queue the statements in pipeline mode and flush them in a single round trip.
+
+        The statements run in a single transaction, so either all or none of them apply.
+        """
+        try:
+            with self._instrument(name):
+                async with self._exclusive() as conn, self._pipeline(conn, True):
+                    async with conn.transaction(), conn.cursor() as cursor:
+                        for query, params in statements:
+                            await self._execute(conn, cursor, query, params)
+        except psycopg.errors.Error as exp:
+            logger.error(exp)
+            return False
+        return True
+
+    @staticmethod
+    def _copy_row(record: dict, columns: dict[str, str]) -> tuple:
+        """Coerce a record into a tuple matching the staging column types."""
+        return tuple(
+            None if record[column] is None
+            else COPY_CASTERS[pg_type](record[column])
+            for column, pg_type in columns.items()
+        )
+
+    async def _copy_merge(
+        self, conn: psycopg.AsyncConnection, staging: str,
+        columns: dict[str, str], rows: list[tuple],
+        merge: Composed, *followups: Composed, pipeline: bool | None = None
+    ) -> int:
+        """Stream rows into a temporary staging table with a binary COPY
+        and merge them into the target table with a single statement.
+
+        Must be called within a transaction, since the staging table is dropped on commit.
+        The `followups` run after the merge, only if it wrote any row, and may read from
+        the staging table too. They are sent as a single pipeline unless `pipeline` is False.
+        Returns the number of rows written by the merge.
+        """
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                SQL("CREATE TEMP TABLE {staging} ({columns}) ON COMMIT DROP").format(
+                    staging=Identifier(staging),
+                    columns=SQL(', ').join(
+                        SQL("{} {}").format(Identifier(column), SQL(pg_type))
+                        for column, pg_type in columns.items()
+                    )
                 )
-            except psycopg.errors.Error as exp:
-                logger.error(exp)
-                return False
+            )
+            async with cursor.copy(
+                SQL("COPY {staging} ({fields}) FROM STDIN (FORMAT BINARY)").format(
+                    staging=Identifier(staging),
+                    fields=SQL(', ').join(map(Identifier, columns))
+                )
+            ) as copy:
+                copy.set_types(list(columns.values()))
+                for row in rows:
+                    await copy.write_row(row)
+            await cursor.execute(merge)
+            written = cursor.rowcount
+            # A replay of unchanged rows leaves nothing to follow up on.
+            if written > 0 and followups:
+                async with self._pipeline(conn, pipeline):
+                    for followup in followups:
+                        await cursor.execute(followup)
+            return written
 
     @ensure_session
-    async def process_ohlc(self, ohlc: list[dict]) -> bool:
-        """Process the OHLC data."""
-        keys = ohlc[0].keys()
-        query = SQL("INSERT INTO ohlc ({fields}) VALUES ({values})").format(
-            fields=SQL(', ').join(map(Identifier, keys)),
-            values=SQL(', ').join([SQL("%s") for _ in keys])
+    async def process_ohlc(
+        self, ohlc: list[dict], pipeline: bool | None = None
+    ) -> dict[str, int] | None:
+        """Bulk load the OHLC data with a binary COPY and upsert it into the ohlc table.
+
+        Records are deduplicated on (ticker, datetime) before the write, keeping the last one,
+        and replays of unchanged rows are no-ops. The snapshots of the written tickers
+        and the candle rollups of the touched buckets are refreshed in the same transaction.
+        Returns the number of written and skipped rows, or None if the batch failed.
+        """
+        key = [list(OHLC_STAGING_COLUMNS).index(column) for column in OHLC_KEY]
+        rows = {}
+        for record in ohlc:
+            try:
+                row = self._copy_row(record, OHLC_STAGING_COLUMNS)
+            except (KeyError, TypeError, ValueError):
+                logger.warning("Skipping malformed OHLC record: %s", record)
+                continue
+            rows[tuple(row[index] for index in key)] = row
+        updatable = [column for column in OHLC_STAGING_COLUMNS if column not in OHLC_KEY]
+        merge = SQL("""
+            INSERT INTO {ohlc} ({fields})
+                SELECT {fields} FROM {staging}
+            ON CONFLICT ({key}) DO UPDATE
+                SET ({updatable}) = ({excluded})
+                WHERE ({current}) IS DISTINCT FROM ({excluded});
+        """).format(
+            ohlc=Identifier("ohlc"),
+            fields=SQL(', ').join(map(Identifier, OHLC_STAGING_COLUMNS)),
+            staging=Identifier("ohlc_staging"),
+            key=SQL(', ').join(map(Identifier, OHLC_KEY)),
+            updatable=SQL(', ').join(map(Identifier, updatable)),
+            current=SQL(', ').join(Identifier("ohlc", column) for column in updatable),
+            excluded=SQL(', ').join(Identifier("excluded", column) for column in updatable)
         )
-        values = [[row[key] for key in keys] for row in ohlc]
-        return await self.insert(query, values)
+        try:
+            with self._instrument("process_ohlc") as stats:
+                async with self._exclusive() as conn:
+                    if self._partitioned:
+                        # Creating a partition locks the parent table,
+                        # so it happens outside of the write transaction.
+                        await self.ensure_partitions(
+                            conn, {row[OHLC_DATETIME_INDEX] for row in rows.values()}
+                        )
+                    async with conn.transaction():
+                        inserted = await self._copy_merge(
+                            conn, "ohlc_staging", OHLC_STAGING_COLUMNS, list(rows.values()), merge,
+                            snapshot_refresh(
+                                SQL("SELECT DISTINCT ticker FROM {staging}").format(
+                                    staging=Identifier("ohlc_staging")
+                                )
+                            ),
+                            *(
+                                rollup_refresh(
+                                    resolution,
+                                    SQL("SELECT ticker, datetime FROM {staging}").format(
+                                        staging=Identifier("ohlc_staging")
+                                    )
+                                )
+                                for resolution in ROLLUP_RESOLUTIONS
+                            ),
+                            BUMP_SNAPSHOT_VERSION,
+                            pipeline=pipeline
+                        )
+                stats["rows"] = inserted
+        except psycopg.errors.Error as exp:
+            logger.error(exp)
+            return None
+        if inserted > 0:
+            latest = max(row[OHLC_DATETIME_INDEX] for row in rows.values())
+            self.ohlc_watermark = max(latest, self.ohlc_watermark or latest)
+        report = {"inserted": inserted, "skipped": len(ohlc) - inserted}
+        logger.success("Upserted %(inserted)s OHLC rows, skipped %(skipped)s.", report)
+        return report
 
     @ensure_session
-    async def get_tickers(self) -> list[str]:
-        """Get the tickers from the database."""
-        return await self.fetchall(
-            SQL("SELECT {fields} FROM {table}").format(
-                fields=SQL(', ').join(map(Identifier, ["ticker", "name"])),
-                table=Identifier("tickers")
+    async def get_tickers(self, symbols: list[str] | None = None) -> list[str]:
+        """Get the tickers from the database, only the ones of the `symbols` if given."""
+        if symbols is not None:
+            return await self.fetchall(
+                STATEMENTS["get_tickers_by_symbols"], (symbols,), readonly=True
             )
-        )
+        return await self.fetchall(STATEMENTS["get_tickers"], readonly=True)
 
     @ensure_session
     async def get_ticker(self, ticker: str) -> dict:
         """Get a ticker from the database."""
-        return await self.fetchone(
-            SQL("SELECT {fields} FROM {table} WHERE ticker = {ticker}").format(
-                fields=SQL(', ').join(map(Identifier, ["ticker", "name"])),
-                table=Identifier("tickers"),
-                ticker=SQL("%s")
+        return await self.fetchone(STATEMENTS["get_ticker"], (ticker,), readonly=True)
+
+    @ensure_session
+    async def get_ohlc(self, tuples: bool = False) -> list[dict] | list[tuple]:
+        """Get the OHLC data from the database, as JOINED_OHLC_COLUMNS tuples if `tuples`."""
+        return await self.fetchall(STATEMENTS["get_ohlc"], readonly=True, tuples=tuples)
+
+    async def stream_ohlc(
+        self, chunk_size: int = 1000, tuples: bool = False
+    ) -> AsyncIterator[list[dict] | list[tuple]]:
+        """Stream the OHLC data from the database in chunks through a server-side cursor.
+
+        The rows are JOINED_OHLC_COLUMNS tuples if `tuples`. Without a pool,
+        the rows are fetched at once, as the shared connection can't hold a cursor open.
+        """
+        if self.session is None:
+            await self.connect()
+        if not self.pooled:
+            rows = await self.get_ohlc(tuples=tuples)
+            for start in range(0, len(rows), chunk_size):
+                yield rows[start:start + chunk_size]
+            return
+        try:
+            with self._instrument("stream_ohlc") as stats:
+                # Named cursors only live within a transaction.
+                async with self._acquire(readonly=True) as conn, conn.transaction():
+                    await conn.execute(SET_STREAM_TIMEOUTS, (
+                        str(int(self.statement_timeouts.get(
+                            "stream_ohlc", self.statement_timeout
+                        ) * 1000)),
+                        str(int(self.stream_idle_timeout * 1000))
+                    ))
+                    async with self._cursor(
+                        conn, tuples, name=f"ohlc_stream_{next(self._cursor_ids)}"
+                    ) as cursor:
+                        await cursor.execute(STATEMENTS["get_ohlc"].query)
+                        while rows := await cursor.fetchmany(chunk_size):
+                            stats["rows"] += len(rows)
+                            yield rows
+        except psycopg.errors.Error as exp:
+            logger.error(exp)
+
+    @ensure_session
+    async def get_ohlc_history(
+        self, ticker: str, start: datetime = None, end: datetime = None,
+        limit: int = 100, after: datetime = None, tuples: bool = False
+    ) -> list[dict] | list[tuple]:
+        """Get a page of the OHLC history of a ticker, newest first.
+
+        Pages are seeked with `after`, the datetime of the last row of the previous page,
+        so every page is a backward range scan of the (ticker, datetime) primary key
+        instead of an OFFSET scan.
+        The rows are OHLC_COLUMNS tuples if `tuples`.
+        """
+        return await self.fetchall(
+            STATEMENTS["get_ohlc_history"],
+            (
+                ticker,
+                datetime.min if start is None else start,
+                datetime.max if end is None else end,
+                datetime.max if after is None else after,
+                limit
             ),
-            (ticker,)
+            readonly=True,
+            tuples=tuples
         )
 
     @ensure_session
-    async def get_ohlc(self) -> list[dict]:
-        """Get the OHLC data from the database."""
+    async def get_candles(
+        self, ticker: str, resolution: str, start: datetime = None,
+        end: datetime = None, limit: int = 500
+    ) -> list[dict]:
+        """Get the rolled up candles of a ticker at a resolution, newest first."""
         return await self.fetchall(
-            SQL("""
-                SELECT {ohlc}.*, {ticker}.name AS stored_company_name
-                    FROM {ohlc}
-                    JOIN {ticker}
-                        ON {ticker}.ticker = {ohlc}.ticker;
-            """).format(
-                ohlc=Identifier("ohlc"),
-                ticker=Identifier("tickers")
-            )
+            STATEMENTS["get_candles"],
+            (
+                resolution,
+                ticker,
+                datetime.min if start is None else start,
+                datetime.max if end is None else end,
+                limit
+            ),
+            readonly=True
         )
 
     @ensure_session
-    async def insert_companies(self, companies: list[Company]) -> bool:
-        """Insert the companies to the database."""
-        query = SQL("""
-            UPDATE {company}
-            SET
-                ticker = updater.ticker,
-                name = updater.name,
-                industry = updater.industry,
-                exchange = updater.exchange,
-                website = updater.website,
-                phone = updater.phone,
-                country = updater.country,
-                logo = updater.logo,
-                market_cap = updater.market_cap,
-                num_shares = updater.num_shares
-            FROM (
-                VALUES
-                    (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ) AS updater (
-                ticker, name, industry, exchange, website, phone,
-                country, logo, market_cap, num_shares
-            )
-            WHERE {company}.ticker = updater.ticker;
+    async def insert_companies(
+        self, companies: list[Company], pipeline: bool | None = None
+    ) -> dict[str, int] | None:
+        """Bulk load the companies with a binary COPY and upsert them into the companies table.
+
+        Companies are deduplicated on the ticker, keeping the last one. Companies of unknown
+        tickers are skipped and so are the profiles which did not change.
+        Returns the number of written and skipped companies, or None if the batch failed.
+        """
+        rows = {
+            company.ticker: self._copy_row(company.model_dump(), COMPANY_STAGING_COLUMNS)
+            for company in companies
+        }
+        updatable = [column for column in COMPANY_STAGING_COLUMNS if column != "ticker"]
+        merge = SQL("""
+            INSERT INTO {company} ({fields})
+                SELECT {staged} FROM {staging}
+                JOIN {ticker} USING (ticker)
+            ON CONFLICT (ticker) DO UPDATE
+                SET ({updatable}) = ({excluded})
+                WHERE ({current}) IS DISTINCT FROM ({excluded});
         """).format(
-            company=Identifier("companies")
+            company=Identifier("companies"),
+            fields=SQL(', ').join(map(Identifier, COMPANY_STAGING_COLUMNS)),
+            staged=SQL(', ').join(
+                Identifier("companies_staging", column) for column in COMPANY_STAGING_COLUMNS
+            ),
+            staging=Identifier("companies_staging"),
+            ticker=Identifier("tickers"),
+            updatable=SQL(', ').join(map(Identifier, updatable)),
+            current=SQL(', ').join(Identifier("companies", column) for column in updatable),
+            excluded=SQL(', ').join(Identifier("excluded", column) for column in updatable)
         )
-        values = [[
-            company.ticker, company.name, company.industry, company.exchange,
-            company.website, company.phone, company.country, company.logo,
-            company.market_cap, company.num_shares
-        ] for company in companies]
-        return await self.insert(query, values)
+        try:
+            with self._instrument("insert_companies") as stats:
+                async with self._exclusive() as conn, conn.transaction():
+                    # The snapshots are served along with the company names.
+                    written = await self._copy_merge(
+                        conn, "companies_staging", COMPANY_STAGING_COLUMNS,
+                        list(rows.values()), merge, BUMP_SNAPSHOT_VERSION, pipeline=pipeline
+                    )
+                stats["rows"] = written
+        except psycopg.errors.Error as exp:
+            logger.error(exp)
+            return None
+        report = {"inserted": written, "skipped": len(companies) - written}
+        logger.success("Upserted %(inserted)s companies, skipped %(skipped)s.", report)
+        return report
 
     @ensure_session
-    async def get_latest_ohlc(self) -> list[dict]:
-        """Get the latest OHLC data from the database."""
-        return await self.fetchall(
-            SQL("""
-                SELECT {ohlc}.*, {ticker}.name AS stored_company_name
-                    FROM {ohlc}
-                    JOIN {ticker}
-                        ON {ticker}.ticker = {ohlc}.ticker
-                    WHERE {ohlc}.datetime = (
-                        SELECT MAX(datetime) FROM {ohlc}
-                    );
-            """).format(
-                ohlc=Identifier("ohlc"),
-                ticker=Identifier("tickers")
+    async def get_latest_ohlc(
+        self, tuples: bool = False, symbols: list[str] | None = None, readonly: bool = True
+    ) -> list[dict] | list[tuple]:
+        """Get the latest OHLC data, as JOINED_OHLC_COLUMNS tuples if `tuples`.
+
+        Only the tickers of the `symbols` are included if given, in a single query.
+        Reads right after an ingestion go to the primary, which has it for sure.
+        """
+        if symbols is not None:
+            return await self.fetchall(
+                STATEMENTS["get_latest_ohlc_by_symbols"], (symbols,),
+                readonly=readonly, tuples=tuples
             )
+        return await self.fetchall(
+            STATEMENTS["get_latest_ohlc"], readonly=readonly, tuples=tuples
         )
 
     @ensure_session
     async def get_insights_input(self) -> list[dict]:
         """Prepate the input for ChatGPT to extract insights from."""
-        return await self.fetchall(
-            SQL("""
-                WITH dates AS (
-                    SELECT DISTINCT datetime
-                    FROM {ohlc}
-                    ORDER BY datetime DESC
-                    LIMIT 2
-                ), history AS (
-                    SELECT *,
-                        LAG(volume) OVER (PARTITION BY ticker ORDER BY datetime) AS prev_volume,
-                        LAG(high) OVER (PARTITION BY ticker ORDER BY datetime) AS prev_high,
-                        LAG(low) OVER (PARTITION BY ticker ORDER BY datetime) AS prev_low,
-                        LAG(open) OVER (PARTITION BY ticker ORDER BY datetime) AS prev_open,
-                        LAG(close) OVER (PARTITION BY ticker ORDER BY datetime) AS prev_close
-                        FROM {ohlc}
-                        JOIN dates USING (datetime)
-                ), change_calc AS (
-                    SELECT *,
-                        CASE
-                            WHEN prev_open IS NOT NULL
-                            THEN abs((
-                                    (open + close + high + low + volume) -
-                                    (prev_open + prev_close + prev_high + prev_low + prev_volume)
-                                ) / (
-                                    prev_open + prev_close + prev_high + prev_low + prev_volume
-                            ))
-                            ELSE 0
-                        END AS change_ratio,
-                        CASE WHEN prev_open IS NOT NULL
-                            THEN (open - prev_open)
-                            ELSE 0
-                        END AS open_delta,
-                        CASE WHEN prev_close IS NOT NULL
-                            THEN (close - prev_close)
-                            ELSE 0
-                        END AS close_delta,
-                        CASE WHEN prev_high IS NOT NULL
-                            THEN (high - prev_high)
-                            ELSE 0
-                        END AS high_delta,
-                        CASE WHEN prev_low IS NOT NULL
-                            THEN (low - prev_low)
-                            ELSE 0
-                        END AS low_delta,
-                        CASE WHEN prev_volume IS NOT NULL
-                            THEN (volume - prev_volume)
-                            ELSE 0
-                        END AS volume_delta
-                        FROM history
-                ), top5 AS
-                (
-                    SELECT ticker
-                    FROM change_calc
-                    ORDER BY abs(change_ratio) DESC
-                    LIMIT 5
-                )
-                SELECT
-                    {ohlc}.datetime, {ohlc}.ticker, {ohlc}.name,
-                    {ohlc}.open, {ohlc}.high, {ohlc}.low, {ohlc}.close,
-                    {ohlc}.volume
-                FROM {ohlc}
-                JOIN top5
-                    ON {ohlc}.ticker = top5.ticker
-                JOIN dates
-                    ON {ohlc}.datetime = dates.datetime
-                ORDER BY datetime DESC;
-            """).format(
-                ohlc=Identifier("ohlc")
-            )
-        )
+        return await self.fetchall(STATEMENTS["get_insights_input"], readonly=True)
 
     @ensure_session
-    async def insert_insights(self, insights: list[dict]) -> bool:
+    async def insert_insights(self, insights: list[dict], pipeline: bool | None = None) -> bool:
         """Insert the insights to the database."""
         return await self.insert(
             SQL("INSERT INTO insights ({fields}) VALUES ({values})").format(
                 fields=SQL(', ').join(map(Identifier, insights[0].keys())),
                 values=SQL(', ').join([SQL("%s") for _ in insights[0].keys()])
             ),
-            [list(record.values()) for record in insights]
+            [list(record.values()) for record in insights],
+            pipeline=self.pipeline_writes if pipeline is None else pipeline,
+            name="insert_insights"
         )
 
     @ensure_session
-    async def get_market_movers(self) -> list[dict]:
+    async def get_market_movers(self, readonly: bool = True) -> list[dict]:
         """Get the market movers from the database."""
-        return await self.fetchall(
-            SQL("""
-                WITH dates AS (
-                    SELECT DISTINCT datetime
-                    FROM {ohlc}
-                    ORDER BY datetime DESC
-                    LIMIT 2
-                ), history AS (
-                    SELECT *,
-                        LAG(volume) OVER (PARTITION BY ticker ORDER BY datetime) AS prev_volume,
-                        LAG(high) OVER (PARTITION BY ticker ORDER BY datetime) AS prev_high,
-                        LAG(low) OVER (PARTITION BY ticker ORDER BY datetime) AS prev_low,
-                        LAG(open) OVER (PARTITION BY ticker ORDER BY datetime) AS prev_open,
-                        LAG(close) OVER (PARTITION BY ticker ORDER BY datetime) AS prev_close
-                        FROM {ohlc}
-                        JOIN dates USING (datetime)
-                ), change_calc AS (
-                    SELECT *,
-                        CASE
-                            WHEN prev_open IS NOT NULL
-                            THEN abs((
-                                    (open + close + high + low + volume) -
-                                    (prev_open + prev_close + prev_high + prev_low + prev_volume)
-                                ) / (
-                                    prev_open + prev_close + prev_high + prev_low + prev_volume
-                            ))
-                            ELSE 0
-                        END AS change_ratio,
-                        CASE WHEN prev_open IS NOT NULL
-                            THEN (open - prev_open)
-                            ELSE 0
-                        END AS open_delta,
-                        CASE WHEN prev_close IS NOT NULL
-                            THEN (close - prev_close)
-                            ELSE 0
-                        END AS close_delta,
-                        CASE WHEN prev_high IS NOT NULL
-                            THEN (high - prev_high)
-                            ELSE 0
-                        END AS high_delta,
-                        CASE WHEN prev_low IS NOT NULL
-                            THEN (low - prev_low)
-                            ELSE 0
-                        END AS low_delta,
-                        CASE WHEN prev_volume IS NOT NULL
-                            THEN (volume - prev_volume)
-                            ELSE 0
-                        END AS volume_delta
-                        FROM history
-                ), top10 AS
-                (
-                    SELECT *
-                    FROM change_calc
-                    ORDER BY abs(change_ratio) DESC
-                    LIMIT 10
+        return await self.fetchall(STATEMENTS["get_market_movers"], readonly=readonly)
+
+    @ensure_session
+    async def get_ohlc_watermark(self, readonly: bool = True) -> tuple[datetime, int] | None:
+        """Get the datetime of the latest OHLC snapshot and the version of the snapshot data.
+
+        The version changes with the corrections of existing rows and companies too.
+        """
+        row = await self.fetchone(STATEMENTS["get_ohlc_watermark"], readonly=readonly)
+        return (row["datetime"], row["version"] or 0) if row and row["datetime"] else None
+
+    @ensure_session
+    async def notify(self, channel: str, payload: str) -> bool:
+        """Notify the listeners of a channel, on the primary."""
+        return await self.insert(NOTIFY, [channel, payload], name="notify")
+
+    async def listen(self, channel: str) -> AsyncIterator[str]:
+        """Yield the payloads of the notifications on a channel.
+
+        Listens on a dedicated connection to the primary, outside the pool,
+        and reconnects when it drops. Notifications sent meanwhile are lost.
+        """
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(
+                    self.conn_str, autocommit=True
+                ) as conn:
+                    await conn.execute(SQL("LISTEN {channel}").format(channel=Identifier(channel)))
+                    logger.info("Listening to the %s notifications.", channel)
+                    async for notification in conn.notifies():
+                        yield notification.payload
+            except psycopg.errors.Error as exp:
+                logger.warning(
+                    "Lost the %s notifications: %s. Retrying in 10 seconds...", channel, exp
                 )
-                SELECT
-                    row_to_json(company.*) AS profile,
-                    json_build_object(
-                        'open', top10.open,
-                        'close', top10.close,
-                        'high', top10.high,
-                        'low', top10.low,
-                        'volume', top10.volume
-                    ) AS current_metrics,
-                    json_build_object(
-                        'open', top10.open_delta,
-                        'close', top10.close_delta,
-                        'high', top10.high_delta,
-                        'low', top10.low_delta,
-                        'volume', top10.volume_delta
-                    ) AS metric_deltas
-                FROM {ohlc}
-                JOIN top10 USING (ticker)
-                JOIN {company} AS company USING (ticker)
-                WHERE {ohlc}.datetime = (SELECT MAX(datetime) FROM dates)
-                ORDER BY {ohlc}.datetime DESC;
-            """).format(
-                ohlc=Identifier("ohlc"),
-                company=Identifier("companies")
-            )
-        )
+                await asyncio.sleep(10)
 
     @ensure_session
     async def check_user(self, username: str, email: str) -> bool:
-        """Check if a user exists."""
-        return await self.fetchone(
-            SQL("""
-                SELECT 1 FROM users
-                    WHERE
-                        username = {username}
-                        OR email = {email}
-            """).format(
-                username=SQL("%s"),
-                email=SQL("%s")
-            ), (username, email)
-        )
+        """Check if a user exists, on the primary so that fresh registrations are seen."""
+        return await self.fetchone(STATEMENTS["check_user"], (username, email))
 
     @ensure_session
     async def create_user(self, email: str, password: str, username: str) -> bool:
         """Create a user."""
-        fields = ["email", "password", "username"]
-        values = [email, password, username]
-        return await self.insert(
-            SQL("""
-                INSERT INTO users ({fields})
-                VALUES ({values})
-            """).format(
-                fields=SQL(",").join(SQL(field) for field in fields),
-                values=SQL(",").join(SQL("%s") for _ in values)
-            ), values
-        )
+        return await self.insert(STATEMENTS["create_user"], [email, password, username])
 
     @ensure_session
     async def get_user(self, username: str) -> dict:
-        """Get a user."""
-        return await self.fetchone(
-            SQL("""
-                SELECT * FROM users
-                    WHERE username = {username}
-            """).format(
-                username=SQL("%s")
-            ), (username,)
-        )
+        """Get a user, on the primary so that fresh registrations are seen."""
+        return await self.fetchone(STATEMENTS["get_user"], (username,))
@@ -0,0 +1,72 @@
+"""Ingestion of the OHLC data, shared by the API server and the consumer.
+
+New snapshots are announced on a Postgres channel, so every API worker can
+invalidate its cache and notify its subscribers, whichever process ingested them.
+"""
+from __future__ import annotations
+from datetime import datetime
+from typing import TYPE_CHECKING
+from uuid import uuid4
+
+import orjson
+
+from utils import logger_factory
+from responses import dumps
+
+if TYPE_CHECKING:
+    from dbconn import DatabaseConnection
+
+
+logger = logger_factory(__name__)
+
+INGESTION_CHANNEL = "ohlc_ingested"
+# Postgres rejects the notification payloads from 8000 bytes on.
+MAX_PAYLOAD_BYTES = 8000
+# Tags the notifications of this process, which handles its own ingestions directly.
+INSTANCE_ID = uuid4().hex
+
+
+async def ingest_ohlc(
+    db_handler: DatabaseConnection, ohlc: list[dict]
+) -> tuple[dict[str, int] | None, dict | None]:
+    """Process the OHLC data and announce the new snapshot once new rows land.
+
+    Returns the report of the ingestion and the event of the new snapshot, if any.
+    """
+    response = await db_handler.process_ohlc(ohlc)
+    if not (response and response["inserted"]):
+        return response, None
+    event = {
+        "datetime": db_handler.ohlc_watermark,
+        "inserted": response["inserted"],
+        "tickers": sorted({record.get("ticker") for record in ohlc} - {None})
+    }
+    # The rows stay out of the payload. Too many tickers don't fit either,
+    # and None stands for all of them, which the listeners refresh in full.
+    payload = dumps(event | {"source": INSTANCE_ID})
+    if len(payload) >= MAX_PAYLOAD_BYTES:
+        event["tickers"] = None
+        payload = dumps(event | {"source": INSTANCE_ID})
+    await db_handler.notify(INGESTION_CHANNEL, payload.decode())
+    return response, event
+
+
+def parse_event(payload: str) -> dict | None:
+    """Parse the event of an ingestion notification.
+
+    None for the ones of this process, and for the malformed ones, which are logged.
+    """
+    try:
+        event = orjson.loads(payload)
+        if event.pop("source", None) == INSTANCE_ID:
+            return None
+        event["datetime"] = datetime.fromisoformat(event["datetime"])
+        tickers = event.setdefault("tickers", None)
+        if tickers is not None and not (
+            isinstance(tickers, list) and all(isinstance(ticker, str) for ticker in tickers)
+        ):
+            raise TypeError("The tickers must be a list of strings.")
+    except (AttributeError, KeyError, TypeError, ValueError) as exc:
+        logger.warning("Skipping a malformed ingestion notification %r: %s", payload, exc)
+        return None
+    return event
@@ -77,8 +77,72 @@ psql -v ON_ERROR_STOP=1 <<-EOSQL
         source VARCHAR(30) NOT NULL,
         PRIMARY KEY (ticker, datetime),
         FOREIGN KEY (ticker) REFERENCES tickers(ticker)
+    ) PARTITION BY RANGE (datetime);
+
+    CREATE TABLE ohlc_y2023m08 PARTITION OF ohlc
+        FOR VALUES FROM ('2023-08-01') TO ('2023-09-01');
+
+    -- Partitions of the current and the next month, the server creates the later ones.
+    DO \$\$
+    DECLARE
+        month DATE;
+    BEGIN
+        FOR month IN
+            SELECT generate_series(
+                date_trunc('month', now() AT TIME ZONE 'UTC'),
+                date_trunc('month', now() AT TIME ZONE 'UTC') + INTERVAL '1 month',
+                INTERVAL '1 month'
+            )::date
+        LOOP
+            EXECUTE format(
+                'CREATE TABLE IF NOT EXISTS %I PARTITION OF ohlc FOR VALUES FROM (%L) TO (%L)',
+                to_char(month, '"ohlc_y"YYYY"m"MM'), month, month + INTERVAL '1 month'
+            );
+        END LOOP;
+    END
+    \$\$;
+
+    CREATE TABLE ohlc_snapshots (
+        ticker VARCHAR(10) NOT NULL,
+        datetime TIMESTAMP NOT NULL,
+        name VARCHAR(50) NOT NULL,
+        open NUMERIC(10, 2) NOT NULL,
+        high NUMERIC(10, 2) NOT NULL,
+        low NUMERIC(10, 2) NOT NULL,
+        close NUMERIC(10, 2) NOT NULL,
+        volume BIGINT NOT NULL,
+        prev_datetime TIMESTAMP NULL,
+        prev_open NUMERIC(10, 2) NULL,
+        prev_high NUMERIC(10, 2) NULL,
+        prev_low NUMERIC(10, 2) NULL,
+        prev_close NUMERIC(10, 2) NULL,
+        prev_volume BIGINT NULL,
+        PRIMARY KEY (ticker),
+        FOREIGN KEY (ticker) REFERENCES tickers(ticker)
     );
 
+    CREATE INDEX ohlc_snapshots_datetime_idx ON ohlc_snapshots (datetime);
+
+    CREATE TABLE ohlc_rollups (
+        resolution VARCHAR(10) NOT NULL,
+        ticker VARCHAR(10) NOT NULL,
+        datetime TIMESTAMP NOT NULL,
+        open NUMERIC(10, 2) NOT NULL,
+        high NUMERIC(10, 2) NOT NULL,
+        low NUMERIC(10, 2) NOT NULL,
+        close NUMERIC(10, 2) NOT NULL,
+        volume BIGINT NOT NULL,
+        PRIMARY KEY (resolution, ticker, datetime),
+        FOREIGN KEY (ticker) REFERENCES tickers(ticker)
+    );
+
+    CREATE TABLE snapshot_version (
+        id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+        version BIGINT NOT NULL DEFAULT 0
+    );
+
+    INSERT INTO snapshot_version DEFAULT VALUES;
+
     CREATE TABLE users (
         id INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
         username VARCHAR(50) NOT NULL,
@@ -96,6 +160,8 @@ psql -v ON_ERROR_STOP=1 <<-EOSQL
         )
     );
 
+    CREATE INDEX insights_datetime_idx ON insights (datetime);
+
     CREATE TABLE companies (
         ticker VARCHAR(10) NOT NULL,
         name VARCHAR(50) NOT NULL,
@@ -517,4 +583,20 @@ psql -v ON_ERROR_STOP=1 <<-EOSQL
         ON ALL TABLES
         IN SCHEMA public
         TO $DB_USER;
+
+    GRANT CREATE ON SCHEMA public TO $DB_USER;
+    ALTER TABLE ohlc OWNER TO $DB_USER;
+    -- Every partition of ohlc, whichever months it was created for.
+    DO \$\$
+    DECLARE
+        partition REGCLASS;
+    BEGIN
+        FOR partition IN SELECT inhrelid FROM pg_inherits WHERE inhparent = 'ohlc'::regclass
+        LOOP
+            EXECUTE format('ALTER TABLE %s OWNER TO %I', partition, '$DB_USER');
+        END LOOP;
+    END
+    \$\$;
+    ALTER TABLE ohlc_snapshots OWNER TO $DB_USER;
+    ALTER TABLE ohlc_rollups OWNER TO $DB_USER;
 EOSQL
\ No newline at end of file
@@ -1,47 +1,77 @@
 """A FastAPI server that connects to a PostgreSQL database."""
 import asyncio
+from datetime import datetime
 import os
-from typing import Annotated
-
-from fastapi import FastAPI, Depends
-from fastapi.responses import JSONResponse
-from fastapi.params import Path
-
-from utils import logger_factory, fetch_password
-from dbconn import DatabaseConnection
-from rcbconn import RabbitMQConnector
+from typing import Annotated, Awaitable, Callable, Hashable
+
+from fastapi import FastAPI, Depends, Header
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.params import Path, Query
+
+from utils import logger_factory, fetch_password, json_rows, ndjson_rows
+from broadcast import Broadcaster
+from cache import SnapshotCache
+from columnar import ARROW_MEDIA_TYPE, arrow_chunks, arrow_rows
+import columnar
+from compression import negotiate, precompress
+from conditional import ConditionalGet
+from config import (
+    CONSUME_INTERVAL, RUN_MODE, database_connection, rabbitmq_connector, rate_limiter
+)
+from metrics import METRICS, MetricsServer
+from middleware import CancelOnDisconnectMiddleware, CompressionMiddleware
+from queries import JOINED_OHLC_COLUMNS, OHLC_COLUMNS
+from responses import ORJSONResponse, dumps
+from singleflight import SingleFlight
 from auth import Authenticator
 from k8s_authorizer import KubernetesAPI
 from gpt_client import GptClient
 from models import (
-    Company, ErrorResponse, OHLC, OHLCResponse, SuccessResponse,
+    CandleResolution, CandlesResponse, Company, ErrorResponse, IngestionResponse,
+    OHLC, OHLCResponse,
+    OHLCHistoryResponse, SuccessResponse,
     Ticker, TickersResponse, Token, User, InsightsResponse,
     MoversResponse
 )
+from ingestion import INGESTION_CHANNEL, parse_event
+import ingestion
 
 
 logger = logger_factory("API Server")
 
+JSON_MEDIA_TYPE = "application/json"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+SSE_MEDIA_TYPE = "text/event-stream"
+# Representations of the bulk OHLC reads vary with the Accept header.
+VARY_ACCEPT = {"Vary": "Accept"}
+COMPRESSION_MIN_SIZE = int(os.getenv("API_COMPRESSION_MIN_SIZE", "500"))
+MAX_SYMBOLS = 100
+
 
 app = FastAPI(
     title="StocksALot API",
-    summary="External API to access the StocksALot data and insights."
+    summary="External API to access the StocksALot data and insights.",
+    default_response_class=ORJSONResponse
 )
+app.add_middleware(CancelOnDisconnectMiddleware)
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
 
 
-db_handler=DatabaseConnection(
-    user=os.getenv("DATABASE_USER", "postgres"),
-    password=fetch_password("DATABASE_PASSWORD"),
-    host=os.getenv("DATABASE_HOST", "localhost"),
-    port=int(os.getenv("DATABASE_PORT", "5432")),
-    database=os.getenv("DATABASE_NAME", "stocks")
+db_handler = database_connection()
+snapshot_cache = SnapshotCache(
+    "snapshots",
+    ttl=float(os.getenv("SNAPSHOT_CACHE_TTL", "60")),
+    maxsize=int(os.getenv("SNAPSHOT_CACHE_MAX_SIZE", "128"))
 )
-rmq_handler=RabbitMQConnector(
-    host=os.getenv("RABBITMQ_HOST", "localhost"),
-    port=int(os.getenv("RABBITMQ_PORT", "5672")),
-    username=os.getenv("RABBITMQ_USER", "guest"),
-    password=fetch_password("RABBITMQ_PASSWORD", default="guest")
+snapshot_broadcaster = Broadcaster(
+    "snapshots",
+    maxsize=int(os.getenv("STREAM_QUEUE_SIZE", "16")),
+    heartbeat=float(os.getenv("STREAM_HEARTBEAT_SECONDS", "15"))
 )
+# Concurrent misses of the same snapshot and insights share a single computation.
+snapshot_flight = SingleFlight("snapshots")
+insights_flight = SingleFlight("insights")
+rmq_handler = rabbitmq_connector()
 k8s_authorizer = KubernetesAPI()
 authenticator = Authenticator(
     db_conn=db_handler,
@@ -49,30 +79,191 @@ authenticator = Authenticator(
     secret_key=os.getenv("API_TOKEN_SECRET"),
     expiry_days=int(os.getenv("API_TOKEN_EXPIRY_DAYS", "365"))
 )
+limiter = rate_limiter()
 gpt_client = GptClient(
     api_key=fetch_password("GPT_API_KEY")
 )
+# The metrics are served on a port of their own, which stays inside the cluster.
+metrics_server = MetricsServer(METRICS, port=int(os.getenv("METRICS_PORT", "9090")))
+
+# Connection and statement stats, read from the database handler on every scrape.
+METRICS.gauge(
+    "db_pool_stat", "Connection pool statistics of the primary.", ("stat",),
+    callback=lambda: {(stat,): value for stat, value in db_handler.get_pool_stats().items()}
+)
+METRICS.gauge(
+    "db_replica_lag_seconds", "Last measured replication lag of the replicas.", ("host",),
+    callback=lambda: {(host,): lag for host, lag in db_handler.get_replica_stats().items()}
+)
+METRICS.counter(
+    "db_statement_executions_total", "Executions of the prepared statements.", ("statement",),
+    callback=lambda: {
+        (name,): stats["executions"]
+        for name, stats in db_handler.get_statement_stats().items()
+    }
+)
+METRICS.counter(
+    "db_statement_prepares_total", "Connections which prepared the statements.", ("statement",),
+    callback=lambda: {
+        (name,): stats["prepares"]
+        for name, stats in db_handler.get_statement_stats().items()
+    }
+)
+
+
+def parse_symbols(symbols: str | None) -> list[str] | None:
+    """Parse comma-separated ticker symbols, deduplicated in their order."""
+    if symbols is None:
+        return None
+    return list(dict.fromkeys(
+        symbol.strip().upper() for symbol in symbols.split(",") if symbol.strip()
+    ))
+
+
+def too_many_symbols() -> JSONResponse:
+    """Respond that a batch lookup asked for more than MAX_SYMBOLS symbols."""
+    return JSONResponse(
+        content={"error": f"At most {MAX_SYMBOLS} symbols can be looked up at once."},
+        status_code=400
+    )
+
+
+def wants_arrow(accept: str | None) -> bool:
+    """Check whether the client asked for an Arrow IPC stream."""
+    return bool(accept) and ARROW_MEDIA_TYPE in accept
+
+
+def arrow_unavailable() -> JSONResponse:
+    """Respond that Arrow IPC streams cannot be built without pyarrow."""
+    return JSONResponse(
+        content={"error": "Arrow responses are not available."},
+        status_code=406
+    )
+
+
+async def get_ohlc_watermark() -> tuple[datetime, int] | None:
+    """Get the datetime and version of the latest OHLC snapshot, cached until the next ingestion.
+
+    Read from the primary, like the snapshot bodies.
+    """
+    return await snapshot_cache.get_or_set(
+        "ohlc_watermark", lambda: db_handler.get_ohlc_watermark(readonly=False)
+    )
+
+
+ohlc_conditional = ConditionalGet(get_ohlc_watermark)
+
+
+async def get_snapshot_body(
+    key: Hashable, fetch: Callable[[], Awaitable[bytes]], encoding: str | None
+) -> tuple[bytes, dict[str, str]]:
+    """Get a body derived from the latest snapshot, along with its encoding headers.
+
+    The body is cached until the next ingestion, and so is its compressed form,
+    so identical payloads are compressed once per snapshot instead of per request.
+    Compressing at the maximum level takes up to a second for large bodies,
+    so it runs in a thread, once for the concurrent requests.
+    `fetch` reads from the primary: a replica may not have replayed the ingestion
+    yet, and its stale body would stay cached for the whole TTL. Being fetched
+    once per snapshot, the bodies cost the primary little.
+    """
+    content = await snapshot_cache.get_or_set(
+        key, lambda: snapshot_flight.run((key, snapshot_cache.generation), fetch)
+    )
+    if encoding is None or len(content) < COMPRESSION_MIN_SIZE:
+        return content, {}
+    async def compress() -> bytes:
+        return await snapshot_flight.run(
+            ((key, encoding), snapshot_cache.generation),
+            lambda: asyncio.to_thread(precompress, content, encoding)
+        )
+    return await snapshot_cache.get_or_set((key, encoding), compress), {
+        "Content-Encoding": encoding, "Vary": "Accept-Encoding"
+    }
+
+
+def rate_limited(endpoint: str) -> Callable[..., Awaitable[str]]:
+    """Depend on the current user, rate limited on the endpoint."""
+    async def current_user(
+        username: Annotated[str, Depends(authenticator.get_current_user)]
+    ) -> str:
+        await limiter.check(endpoint, username)
+        return username
+    return current_user
+
+
+async def announce_snapshot(event: dict):
+    """Invalidate the cached snapshots and notify the subscribers of a new snapshot.
+
+    The events carry the latest rows of the ingested tickers, or of every ticker when
+    they are not listed, as served by `/latest`, whichever process ingested them.
+    They are only fetched for the subscribers, from the primary, as the replicas
+    may not have replayed the ingestion yet.
+    """
+    snapshot_cache.invalidate(event["datetime"])
+    rows = (
+        await db_handler.get_latest_ohlc(symbols=event["tickers"], readonly=False)
+        if snapshot_broadcaster.subscribers else []
+    )
+    snapshot_broadcaster.publish(
+        "snapshot", event, rows=rows, event_id=event["datetime"].isoformat()
+    )
+
+
+async def ingest_ohlc(ohlc: list[dict]) -> dict[str, int] | None:
+    """Process the OHLC data, then announce the new snapshot once new rows land."""
+    response, event = await ingestion.ingest_ohlc(db_handler, ohlc)
+    if event:
+        await announce_snapshot(event)
+    return response
+
+
+async def follow_ingestions():
+    """Announce the snapshots ingested by the other processes, such as the consumer."""
+    async for payload in db_handler.listen(INGESTION_CHANNEL):
+        try:
+            if event := parse_event(payload):
+                await announce_snapshot(event)
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.error("Failed to announce an ingestion.")
+            logger.error(exc)
+
+
+METRICS.gauge(
+    "broadcast_subscribers", "Clients subscribed to the event streams.", ("channel",),
+    callback=lambda: {("snapshots",): len(snapshot_broadcaster.subscribers)}
+)
 
 
 @app.on_event("startup")
 async def startup():
-    """On API startup, connect to the database."""""
+    """On API startup, connect to the database.
+
+    The `all` run mode consumes the OHLC queue in this process as well,
+    the `api` one leaves it to a separate consumer.
+    """
     await db_handler.connect()
-    await rmq_handler.connect()
     await k8s_authorizer.connect()
-    asyncio.create_task(
-        rmq_handler.periodic_consume(
-            "ohlc", db_handler.process_ohlc, 120
+    await metrics_server.start()
+    asyncio.create_task(follow_ingestions())
+    if RUN_MODE == "all":
+        await rmq_handler.connect()
+        asyncio.create_task(
+            rmq_handler.periodic_consume(
+                "ohlc", ingest_ohlc, CONSUME_INTERVAL
+            )
         )
-    )
 
 
 @app.on_event("shutdown")
 async def shutdown():
-    """On API shutdown, disconnect from the database."""""
+    """On API shutdown, disconnect from the database."""
     await db_handler.disconnect()
-    await rmq_handler.disconnect()
+    if RUN_MODE == "all":
+        await rmq_handler.disconnect()
     await k8s_authorizer.disconnect()
+    await limiter.close()
+    await metrics_server.close()
 
 
 @app.post(
@@ -113,21 +304,33 @@ async def login_user(
     return token
 
 
-@app.get('/tickers', response_model=TickersResponse, openapi_extra={
-    "description": """
-    NOTE: This endpoint is for testing the API without authentication.
-    """
-})
-async def get_tickers() -> TickersResponse:
-    """Get all tickers."""
+@app.get(
+    '/tickers',
+    response_model=TickersResponse,
+    responses={400: {"model": ErrorResponse, "description": "Too many symbols."}},
+    openapi_extra={
+        "description": """
+        NOTE: This endpoint is for testing the API without authentication.
+        """
+    }
+)
+async def get_tickers(
+    headers: Annotated[dict[str, str], Depends(ohlc_conditional)],
+    symbols: str = Query(
+        None, description=f"Comma-separated ticker symbols to look up, at most {MAX_SYMBOLS}."
+    )
+) -> TickersResponse:
+    """Get all tickers, or the ones of the `symbols` in a single lookup."""
+    symbols = parse_symbols(symbols)
+    if symbols is not None and len(symbols) > MAX_SYMBOLS:
+        return too_many_symbols()
     try:
-        items = await db_handler.get_tickers()
-        response = {"count": len(items), "items": items}
+        items = await db_handler.get_tickers(symbols)
     except Exception as exc:  # pylint: disable=broad-except
         logger.error("Failed to get tickers.")
         logger.error(exc)
-        response = {"count": 0, "items": []}
-    return TickersResponse(**response)
+        items, headers = [], {}
+    return ORJSONResponse({"count": len(items), "items": items}, headers=headers)
 
 
 @app.get(
@@ -158,40 +361,139 @@ async def get_ticker(
             content={"error": "Ticker not found."},
             status_code=404
         )
-    return Ticker(**response)
+    return ORJSONResponse(response)
 
 
 @app.get(
     '/ohlc',
     response_model=OHLCResponse,
     include_in_schema=False,
-    responses={401: {"model": ErrorResponse, "description": "Missing Bearer Token."}}
+    responses={
+        401: {"model": ErrorResponse, "description": "Missing Bearer Token."},
+        406: {"model": ErrorResponse, "description": "Arrow responses are not available."},
+        429: {"model": ErrorResponse, "description": "Too many requests."}
+    }
 )
 async def get_ohlc(
-    username: Annotated[str, Depends(authenticator.get_current_user)]
+    username: Annotated[str, Depends(rate_limited("ohlc"))],
+    accept: Annotated[str, Header()] = None
 ) -> OHLCResponse:
-    """Get all OHLC data."""
+    """Get all OHLC data.
+
+    Send `Accept: application/x-ndjson` to stream the rows as newline-delimited JSON,
+    or `Accept: application/vnd.apache.arrow.stream` to stream them as Arrow record batches.
+    """
     if username != "internal":
         logger.info("User %s requested all the OHLC data.", username)
         return JSONResponse(
             content={"error": "You shall not pass."},
             status_code=403
         )
+    if wants_arrow(accept):
+        if not columnar.available():
+            return arrow_unavailable()
+        return StreamingResponse(
+            arrow_chunks(JOINED_OHLC_COLUMNS, db_handler.stream_ohlc(tuples=True)),
+            media_type=ARROW_MEDIA_TYPE, headers=VARY_ACCEPT
+        )
+    if accept and NDJSON_MEDIA_TYPE in accept:
+        return StreamingResponse(
+            ndjson_rows(JOINED_OHLC_COLUMNS, db_handler.stream_ohlc(tuples=True)),
+            media_type=NDJSON_MEDIA_TYPE, headers=VARY_ACCEPT
+        )
     try:
-        items = await db_handler.get_ohlc()
-        response = {"count": len(items), "items": items}
+        items = await db_handler.get_ohlc(tuples=True)
     except Exception as exc:  # pylint: disable=broad-except
         logger.error("Failed to get OHLC data.")
         logger.error(exc)
-        response = {"count": 0, "items": []}
-    return OHLCResponse(**response)
+        items = []
+    return Response(
+        json_rows(JOINED_OHLC_COLUMNS, items), media_type=JSON_MEDIA_TYPE, headers=VARY_ACCEPT
+    )
+
+
+@app.get(
+    '/ohlc/{ticker}',
+    response_model=OHLCHistoryResponse,
+    responses={
+        401: {"model": ErrorResponse, "description": "Missing Bearer Token."},
+        406: {"model": ErrorResponse, "description": "Arrow responses are not available."},
+        429: {"model": ErrorResponse, "description": "Too many requests."}
+    }
+)
+async def get_ohlc_history(  # pylint: disable=too-many-arguments
+    username: Annotated[str, Depends(rate_limited("ohlc_history"))],
+    ticker: str = Path(..., description="The ticker symbol of the stock"),
+    start: datetime = Query(None, alias="from", description="Oldest datetime to include."),
+    end: datetime = Query(None, alias="to", description="Newest datetime to include."),
+    limit: int = Query(100, ge=1, le=1000, description="The maximum number of records."),
+    after: datetime = Query(None, description="The `next` value of the previous page."),
+    accept: Annotated[str, Header()] = None
+) -> OHLCHistoryResponse:
+    """Get the OHLC history of a ticker, newest first, one page at a time.
+
+    Send `Accept: application/vnd.apache.arrow.stream` to get the page as an Arrow record batch,
+    with the `next` value in the `X-Next` header.
+    """
+    if username != "internal":
+        logger.info("User %s requested the OHLC history of %s.", username, ticker)
+    if wants_arrow(accept) and not columnar.available():
+        return arrow_unavailable()
+    try:
+        items = await db_handler.get_ohlc_history(
+            ticker, start, end, limit, after, tuples=True
+        )
+    except Exception as exc:  # pylint: disable=broad-except
+        logger.error("Failed to get OHLC history of %s.", ticker)
+        logger.error(exc)
+        items = []
+    after = items[-1][OHLC_COLUMNS.index("datetime")] if len(items) == limit else None
+    if wants_arrow(accept):
+        return Response(
+            arrow_rows(OHLC_COLUMNS, items), media_type=ARROW_MEDIA_TYPE,
+            headers=VARY_ACCEPT | ({"X-Next": after.isoformat()} if after else {})
+        )
+    return Response(
+        json_rows(OHLC_COLUMNS, items, next=after),
+        media_type=JSON_MEDIA_TYPE, headers=VARY_ACCEPT
+    )
+
+
+@app.get(
+    '/ohlc/{ticker}/candles',
+    response_model=CandlesResponse,
+    responses={
+        401: {"model": ErrorResponse, "description": "Missing Bearer Token."},
+        429: {"model": ErrorResponse, "description": "Too many requests."}
+    }
+)
+async def get_candles(  # pylint: disable=too-many-arguments
+    username: Annotated[str, Depends(rate_limited("candles"))],
+    ticker: str = Path(..., description="The ticker symbol of the stock"),
+    resolution: CandleResolution = Query(
+        CandleResolution.DAY, alias="interval", description="The resolution of the candles."
+    ),
+    start: datetime = Query(None, alias="from", description="Oldest candle to include."),
+    end: datetime = Query(None, alias="to", description="Newest candle to include."),
+    limit: int = Query(500, ge=1, le=1000, description="The maximum number of candles.")
+) -> CandlesResponse:
+    """Get the daily, weekly or monthly candles of a ticker, newest first."""
+    if username != "internal":
+        logger.info("User %s requested the %s candles of %s.", username, resolution.value, ticker)
+    try:
+        items = await db_handler.get_candles(ticker, resolution.value, start, end, limit)
+    except Exception as exc:  # pylint: disable=broad-except
+        logger.error("Failed to get the candles of %s.", ticker)
+        logger.error(exc)
+        items = []
+    return ORJSONResponse({"count": len(items), "resolution": resolution.value, "items": items})
 
 
 @app.post('/ohlc', status_code=201, include_in_schema=False)
 async def post_ohlc(
     ohlc: list[OHLC],
     username: Annotated[str, Depends(authenticator.get_current_user)] = None
-) -> SuccessResponse:
+) -> IngestionResponse:
     """Post OHLC data."""
     if username != "internal":
         logger.info("User %s posted %s OHLC records.", username, len(ohlc))
@@ -205,7 +507,7 @@ async def post_ohlc(
             status_code=400
         )
     try:
-        response = await db_handler.process_ohlc(
+        response = await ingest_ohlc(
             [record.model_dump() for record in ohlc]
         )
         if not response:
@@ -220,14 +522,14 @@ async def post_ohlc(
             content={"error": "Error inserting data."},
             status_code=400
         )
-    return SuccessResponse(status="ok")
+    return IngestionResponse(status="ok", **response)
 
 
 @app.put('/companies', status_code=200, include_in_schema=False)
 async def put_companies(
     companies: list[Company],
     username: Annotated[str, Depends(authenticator.get_current_user)]
-) -> SuccessResponse:
+) -> IngestionResponse:
     """Put company data."""
     if username != "internal":
         logger.info("User %s put %s company records.", username, len(companies))
@@ -249,59 +551,123 @@ async def put_companies(
             content={"error": "Error inserting data."},
             status_code=400
         )
-    if not response:
+    if response is None:
         return JSONResponse(
             content={"error": "Error inserting data."},
             status_code=400
         )
-    return SuccessResponse(status="ok")
+    if response["inserted"]:
+        # The snapshots carry the company names.
+        snapshot_cache.invalidate()
+    return IngestionResponse(status="ok", **response)
 
 
-@app.get("/latest", response_model=OHLCResponse, openapi_extra={
-    "summary": "Get the latest OHLC data.",
-    "description": """
-    Note: This endpoint does not provide price deltas.
-    Caching should be implemented on the client side.
-    """
-})
+@app.get(
+    "/latest",
+    response_model=OHLCResponse,
+    responses={
+        400: {"model": ErrorResponse, "description": "Too many symbols."},
+        406: {"model": ErrorResponse, "description": "Arrow responses are not available."},
+        429: {"model": ErrorResponse, "description": "Too many requests."}
+    },
+    openapi_extra={
+        "summary": "Get the latest OHLC data.",
+        "description": """
+        Note: This endpoint does not provide price deltas.
+        Responses carry an ETag and Last-Modified to revalidate against.
+        Send `Accept: application/vnd.apache.arrow.stream` to get an Arrow record batch.
+        """
+    }
+)
 async def get_latest_ohlc(
-    username: Annotated[
-    str, Depends(authenticator.get_current_user)
-]) -> OHLCResponse:
-    """Get the latest OHLC data."""
+    username: Annotated[str, Depends(rate_limited("latest"))],
+    headers: Annotated[dict[str, str], Depends(ohlc_conditional)],
+    accept: Annotated[str, Header()] = None,
+    accept_encoding: Annotated[str, Header()] = None,
+    symbols: str = Query(
+        None, description=f"Comma-separated ticker symbols to include, at most {MAX_SYMBOLS}."
+    )
+) -> OHLCResponse:
+    """Get the latest OHLC data, of every ticker or only the ones of the `symbols`."""
     if username != "internal":
         logger.info("User %s requested the latest OHLC data.", username)
+    symbols = parse_symbols(symbols)
+    if symbols is not None and len(symbols) > MAX_SYMBOLS:
+        return too_many_symbols()
+    if wants_arrow(accept):
+        if not columnar.available():
+            return arrow_unavailable()
+        media_type, serialize = ARROW_MEDIA_TYPE, arrow_rows
+    else:
+        media_type, serialize = JSON_MEDIA_TYPE, json_rows
+    async def fetch() -> bytes:
+        return serialize(
+            JOINED_OHLC_COLUMNS,
+            await db_handler.get_latest_ohlc(tuples=True, symbols=symbols, readonly=False)
+        )
     try:
-        items = await db_handler.get_latest_ohlc()
-        response = {"count": len(items), "items": items}
+        content, encoding_headers = await get_snapshot_body(
+            ("latest", media_type, None if symbols is None else tuple(sorted(symbols))),
+            fetch, negotiate(accept_encoding)
+        )
     except Exception as exc:  # pylint: disable=broad-except
         logger.error("Failed to get latest OHLC data.")
         logger.error(exc)
-        response = {"count": 0, "items": []}
-    return OHLCResponse(**response)
+        content, headers, encoding_headers = serialize(JOINED_OHLC_COLUMNS, []), {}, {}
+    vary = {"Vary": ", ".join(filter(None, ["Accept", encoding_headers.get("Vary")]))}
+    return Response(
+        content, media_type=media_type, headers=headers | encoding_headers | vary
+    )
+
 
+async def generate_insights() -> tuple[InsightsResponse, bool]:
+    """Prompt GPT for insights from the latest stocks and store them.
 
-@app.get("/insights", response_model=InsightsResponse)
+    Returns the insights and whether they were stored.
+    """
+    items = await db_handler.get_insights_input()
+    result = await gpt_client.prompt(items)
+    records = []
+    for item in result.items:
+        for insight in item.insights:
+            record = insight.model_dump() | {"datetime": item.datetime}
+            records.append(record)
+    if not records:
+        return result, False
+    try:
+        await db_handler.insert_insights(records)
+    except Exception as exc:  # pylint: disable=broad-except
+        logger.warning("Failed to insert insights.")
+        logger.warning(exc)
+        return result, False
+    return result, True
+
+
+@app.get(
+    "/insights",
+    response_model=InsightsResponse,
+    responses={429: {"model": ErrorResponse, "description": "Too many requests."}}
+)
 async def get_insights(
-    username: Annotated[str, Depends(authenticator.get_current_user)]
+    username: Annotated[str, Depends(rate_limited("insights"))],
+    response: Response,
+    headers: Annotated[dict[str, str], Depends(ohlc_conditional)]
 ) -> InsightsResponse:
-    """Get insights from the latest stocks."""
+    """Get insights from the latest stocks.
+
+    The insights are derived from the latest OHLC snapshot, and validated against it,
+    so clients holding the insights of the current snapshot don't prompt GPT again.
+    """
     if username != "internal":
         logger.info("User %s requested for insights.", username)
     try:
-        items = await db_handler.get_insights_input()
-        result = await gpt_client.prompt(items)
-        records = []
-        for item in result.items:
-            for insight in item.insights:
-                record = insight.model_dump() | {"datetime": item.datetime}
-                records.append(record)
-        if records:
-            try:
-                await db_handler.insert_insights(records)
-            except Exception as exc:  # pylint: disable=broad-except
-                logger.warning("Failed to insert insights.")
-                logger.warning(exc)
+        result, stored = await insights_flight.run(
+            await get_ohlc_watermark(), generate_insights
+        )
+        # Failures are left without validators, so that they are not revalidated.
+        # The GPT client reports its failures as empty insights, which are never stored.
+        if stored:
+            response.headers.update(headers)
     except Exception as exc:  # pylint: disable=broad-except
         logger.error("Failed to get insights.")
         logger.error(exc)
@@ -310,22 +676,67 @@ async def get_insights(
 
 
 @app.get("/market_movers", response_model=MoversResponse, include_in_schema=False)
-@app.get("/movers", response_model=MoversResponse)
+@app.get(
+    "/movers",
+    response_model=MoversResponse,
+    responses={429: {"model": ErrorResponse, "description": "Too many requests."}}
+)
 async def get_market_movers(
-    username: Annotated[str, Depends(authenticator.get_current_user)]
+    username: Annotated[str, Depends(rate_limited("movers"))],
+    headers: Annotated[dict[str, str], Depends(ohlc_conditional)],
+    accept_encoding: Annotated[str, Header()] = None
 ) -> MoversResponse:
     """Get the market movers."""
     if username != "internal":
         logger.info("User %s requested for market movers.", username)
+    async def fetch() -> bytes:
+        items = await db_handler.get_market_movers(readonly=False)
+        return dumps({"count": len(items), "items": items})
     try:
-        items = await db_handler.get_market_movers()
+        content, encoding_headers = await get_snapshot_body(
+            "movers", fetch, negotiate(accept_encoding)
+        )
     except Exception as exc:  # pylint: disable=broad-except
         logger.error("Failed to get market movers.")
         logger.error(exc)
-        items = []
-    return MoversResponse(count=len(items), items=items)
+        return ORJSONResponse({"count": 0, "items": []})
+    return Response(content, media_type=JSON_MEDIA_TYPE, headers=headers | encoding_headers)
+
+
+@app.get(
+    "/stream",
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {SSE_MEDIA_TYPE: {}}, "description": "A stream of snapshot events."},
+        401: {"model": ErrorResponse, "description": "Missing Bearer Token."},
+        429: {"model": ErrorResponse, "description": "Too many requests."}
+    }
+)
+async def stream_snapshots(
+    username: Annotated[str, Depends(rate_limited("stream"))],
+    rows: bool = Query(
+        False, description="Include the latest rows of the ingested tickers in the events."
+    )
+) -> StreamingResponse:
+    """Stream a `snapshot` Server-Sent Event whenever new OHLC data lands.
+
+    The events carry the datetime of the new snapshot, the number of written rows
+    and the tickers they belong to, or null when there are too many to list,
+    so clients refetch `/latest` and `/movers` only then.
+    Clients which fall behind skip to the newest events.
+    """
+    if username != "internal":
+        logger.info("User %s subscribed to the snapshot events.", username)
+    return StreamingResponse(
+        snapshot_broadcaster.stream(rows), media_type=SSE_MEDIA_TYPE,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("DB_SERVER_PORT", 5000)))
+    if RUN_MODE == "consumer":
+        from consumer import consume
+        asyncio.run(consume())
+    else:
+        import uvicorn
+        uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("DB_SERVER_PORT", 5000)))
@@ -0,0 +1,212 @@
+"""Minimal Prometheus metrics, rendered in the text exposition format."""
+from __future__ import annotations
+import asyncio
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Callable
+
+from utils import logger_factory
+
+
+logger = logger_factory(__name__)
+
+# Latency buckets in seconds, from a cached lookup to a full table scan.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escape(value: object) -> str:
+    """Escape a label value."""
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+def format_labels(labelnames: tuple[str, ...], labels: tuple, **extra: object) -> str:
+    """Format the label pairs of a sample."""
+    pairs = list(zip(labelnames, labels)) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+class Metric:
+    """Base class of the metrics, labelled by `labelnames`.
+
+    A `callback` returning the samples by their label values can stand in for
+    the recorded values, for metrics which are read from elsewhere at scrape time.
+    """
+    kind = "untyped"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+        callback: Callable[[], dict[tuple, float]] = None
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self.values: dict[tuple, float] = defaultdict(int)
+
+    def __repr__(self) -> str:
+        return f"<[{self.__class__.__name__}] {self.name}>"
+
+    def samples(self) -> list[str]:
+        """Get the samples of the metric in the text format."""
+        values = self.callback() if self.callback else self.values
+        return [
+            f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+            for labels, value in values.items()
+        ]
+
+    def render(self) -> str:
+        """Render the metric with its help and type lines."""
+        return "\n".join([
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self.samples()
+        ])
+
+
+class Counter(Metric):
+    """A value which only goes up."""
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1):
+        """Increment the counter of the label values."""
+        self.values[labels] += amount
+
+
+class Gauge(Metric):
+    """A value which goes up and down."""
+    kind = "gauge"
+
+    def set(self, *labels: str, value: float):
+        """Set the gauge of the label values."""
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    """Observations counted in cumulative buckets, along with their sum and count."""
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.counts: dict[tuple, list[int]] = defaultdict(lambda: [0] * (len(self.buckets) + 1))
+        self.sums: dict[tuple, float] = defaultdict(float)
+
+    def observe(self, *labels: str, value: float):
+        """Count an observation in the first bucket covering it."""
+        self.counts[labels][bisect_left(self.buckets, value)] += 1
+        self.sums[labels] += value
+
+    def samples(self) -> list[str]:
+        lines = []
+        for labels, counts in self.counts.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket"
+                    f"{format_labels(self.labelnames, labels, le=bound)} {cumulative}"
+                )
+            suffix = format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{suffix} {self.sums[labels]}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds the metrics by name and renders them for a scrape."""
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """Register a metric under its unique name.
+
+        Registering a metric of the same name and kind again returns the registered one.
+        """
+        if registered := self.metrics.get(metric.name):
+            if registered.kind != metric.kind:
+                raise ValueError(f"Metric {metric.name} is already registered.")
+            return registered
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        """Register a counter."""
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        """Register a gauge."""
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        """Register a histogram."""
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self) -> str:
+        """Render every metric in the text exposition format."""
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+
+class MetricsServer:
+    """Serves the metrics of a registry on GET /metrics, on a port of their own.
+
+    It listens within the process recording the metrics, apart from the API,
+    so that the port can stay inside the cluster. The metrics are the ones of this
+    process alone. Under several workers, the first one to bind the port serves its
+    metrics and the others log that they don't. The deployments run a single worker
+    per pod and scale with replicas instead, Prometheus sums up the pods.
+    """
+    def __init__(self, registry: MetricsRegistry, host: str = "0.0.0.0", port: int = 9090):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.server: asyncio.Server | None = None
+
+    def __repr__(self) -> str:
+        return f"<[{self.__class__.__name__}] {self.host}:{self.port}>"
+
+    async def start(self) -> bool:
+        """Start listening, returning False if the port is taken."""
+        try:
+            self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        except OSError as exp:
+            logger.warning("Not serving the metrics of this process: %s", exp)
+            return False
+        logger.info("Serving the metrics on port %s.", self.port)
+        return True
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Answer a request with the metrics, or with a 404 off the /metrics path."""
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=10)
+            method, target, _ = request.split(b"\r\n", 1)[0].decode("latin-1").split(" ", 2)
+            if method == "GET" and target.split("?", 1)[0] == "/metrics":
+                status, content_type = "200 OK", CONTENT_TYPE
+                body = self.registry.render().encode()
+            else:
+                status, content_type, body = "404 Not Found", "text/plain", b"Not Found"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def close(self):
+        """Stop listening."""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
@@ -0,0 +1,115 @@
+"""ASGI middlewares of the API server."""
+from __future__ import annotations
+import asyncio
+from typing import TYPE_CHECKING
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from compression import StreamCompressor, negotiate
+from utils import logger_factory
+
+if TYPE_CHECKING:
+    from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+logger = logger_factory(__name__)
+
+
+# pylint: disable=too-few-public-methods
+class CancelOnDisconnectMiddleware:
+    """Cancels the handling of a request once its client disconnects.
+
+    The cancellation reaches the awaited database query, which psycopg then cancels
+    on the server, so abandoned requests stop holding connections.
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        messages: asyncio.Queue[Message] = asyncio.Queue()
+        responded = asyncio.Event()
+
+        async def relay():
+            """Forward the request messages to the app until the client disconnects."""
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    return
+
+        async def tracked_send(message: Message):
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body"):
+                responded.set()
+
+        handler = asyncio.create_task(self.app(scope, messages.get, tracked_send))
+        listener = asyncio.create_task(relay())
+        try:
+            await asyncio.wait({handler, listener}, return_when=asyncio.FIRST_COMPLETED)
+            if not handler.done() and not responded.is_set():
+                logger.info("Client disconnected from %s, cancelling the request.", scope["path"])
+                handler.cancel()
+                try:
+                    await handler
+                except asyncio.CancelledError:
+                    return
+            await handler
+        finally:
+            listener.cancel()
+            handler.cancel()
+
+
+class CompressionMiddleware:
+    """Compresses the response bodies in the encoding negotiated from Accept-Encoding.
+
+    Bodies below `minimum_size` bytes go out as they are, unless they are streamed.
+    Responses which already carry a Content-Encoding, such as the precompressed
+    snapshots, pass through untouched.
+    """
+    def __init__(self, app: ASGIApp, minimum_size: int = 500):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding")) if (
+            scope["type"] == "http"
+        ) else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        initial: Message | None = None
+        compressor: StreamCompressor | None = None
+
+        async def compressing_send(message: Message):
+            nonlocal initial, compressor
+            if message["type"] == "http.response.start":
+                # Held back until the first body tells whether to compress.
+                initial = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body, more_body = message.get("body", b""), message.get("more_body", False)
+            if initial is not None:
+                start, initial = initial, None
+                headers = MutableHeaders(raw=start["headers"])
+                if "content-encoding" not in headers and (
+                    more_body or len(body) >= self.minimum_size
+                ):
+                    compressor = StreamCompressor(encoding)
+                    headers["Content-Encoding"] = encoding
+                    headers.add_vary_header("Accept-Encoding")
+                    del headers["Content-Length"]
+                    body = compressor.compress(body, final=not more_body)
+                    if not more_body:
+                        headers["Content-Length"] = str(len(body))
+                    message = message | {"body": body}
+                await send(start)
+            elif compressor is not None:
+                message = message | {"body": compressor.compress(body, final=not more_body)}
+            await send(message)
+
+        await self.app(scope, receive, compressing_send)
@@ -20,6 +20,12 @@ class SuccessResponse(BaseModel):
     status: Literal["ok"] = Field(..., description="The status of the registration.")
 
 
+class IngestionResponse(SuccessResponse):
+    """A model representing the response of a bulk write."""
+    inserted: int = Field(..., description="The number of rows written.")
+    skipped: int = Field(..., description="The number of rows skipped.")
+
+
 class ErrorResponse(BaseModel):
     """A model representing an error response."""
     detail: str = Field(..., description="The error message.", alias="error")
@@ -90,6 +96,40 @@ class OHLCResponse(BaseModel):
     items: list[JoinedOHLCData] = Field(..., description="The list of OHLC data.")
 
 
+class OHLCHistoryResponse(BaseModel):
+    """A model representing a page of the OHLC history of a stock."""
+    count: int = Field(..., description="The number of OHLC data in the page.")
+    items: list[OHLC] = Field(..., description="The list of OHLC data, newest first.")
+    next: dt | None = Field(
+        default=None,
+        description="Pass this as `after` to get the next page. Empty on the last page."
+    )
+
+
+class CandleResolution(Enum):
+    """A class representing the resolutions of the rolled up candles."""
+    DAY = "1day"
+    WEEK = "1week"
+    MONTH = "1month"
+
+
+class Candle(BaseModel):
+    """A model representing a candle rolled up from the hourly OHLC data."""
+    datetime: dt = Field(..., description="The start of the candle.")
+    open: float = Field(..., description="The opening price within the candle.")
+    high: float = Field(..., description="The highest price within the candle.")
+    low: float = Field(..., description="The lowest price within the candle.")
+    close: float = Field(..., description="The closing price within the candle.")
+    volume: float = Field(..., description="The volume traded within the candle.")
+
+
+class CandlesResponse(BaseModel):
+    """A model representing the response of the candles of a stock."""
+    count: int = Field(..., description="The number of candles.")
+    resolution: CandleResolution = Field(..., description="The resolution of the candles.")
+    items: list[Candle] = Field(..., description="The list of candles, newest first.")
+
+
 class Company(BaseModel):
     """A model representing a company."""
     ticker: str = Field(..., description="The ticker symbol of the stock.")
@@ -0,0 +1,469 @@
+"""SQL of the DatabaseConnection, composed once at import."""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+from psycopg.sql import SQL, Identifier, Literal
+
+from statements import StatementRegistry
+
+if TYPE_CHECKING:
+    from psycopg.sql import Composable, Composed
+
+
+def snapshot_refresh(tickers: Composable) -> Composed:
+    """Recompute the current and previous bars of the selected tickers into ohlc_snapshots.
+
+    Each ticker costs two backward lookups of the primary key, whatever the history size.
+    """
+    return SQL("""
+        INSERT INTO {snapshots} (
+            ticker, datetime, name, open, high, low, close, volume,
+            prev_datetime, prev_open, prev_high, prev_low, prev_close, prev_volume
+        )
+        SELECT
+            cur.ticker, cur.datetime, cur.name,
+            cur.open, cur.high, cur.low, cur.close, cur.volume,
+            prev.datetime, prev.open, prev.high, prev.low, prev.close, prev.volume
+        FROM ({tickers}) AS batch
+        CROSS JOIN LATERAL (
+            SELECT * FROM {ohlc}
+                WHERE {ohlc}.ticker = batch.ticker
+                ORDER BY {ohlc}.datetime DESC
+                LIMIT 1
+        ) AS cur
+        LEFT JOIN LATERAL (
+            SELECT * FROM {ohlc}
+                WHERE {ohlc}.ticker = batch.ticker
+                    AND {ohlc}.datetime < cur.datetime
+                ORDER BY {ohlc}.datetime DESC
+                LIMIT 1
+        ) AS prev ON TRUE
+        ON CONFLICT (ticker) DO UPDATE
+            SET (
+                datetime, name, open, high, low, close, volume,
+                prev_datetime, prev_open, prev_high, prev_low, prev_close, prev_volume
+            ) = (
+                excluded.datetime, excluded.name,
+                excluded.open, excluded.high, excluded.low, excluded.close, excluded.volume,
+                excluded.prev_datetime, excluded.prev_open, excluded.prev_high,
+                excluded.prev_low, excluded.prev_close, excluded.prev_volume
+            );
+    """).format(
+        snapshots=Identifier("ohlc_snapshots"),
+        ohlc=Identifier("ohlc"),
+        tickers=tickers
+    )
+
+
+# Resolutions of the candle rollups, along with the date_trunc field of their buckets.
+ROLLUP_RESOLUTIONS = {
+    "1day": "day",
+    "1week": "week",
+    "1month": "month"
+}
+ROLLUP_FIELDS = ["open", "high", "low", "close", "volume"]
+
+
+def rollup_refresh(resolution: str, rows: Composable) -> Composed:
+    """Recompute the candles of the buckets touched by the (ticker, datetime) rows.
+
+    Only the touched buckets are aggregated, each one from the bars within its own range.
+    """
+    field = ROLLUP_RESOLUTIONS[resolution]
+    return SQL("""
+        INSERT INTO {rollups} (resolution, ticker, datetime, {fields})
+        SELECT
+            {resolution}, {ohlc}.ticker, touched.bucket,
+            (array_agg({ohlc}.open ORDER BY {ohlc}.datetime))[1],
+            max({ohlc}.high),
+            min({ohlc}.low),
+            (array_agg({ohlc}.close ORDER BY {ohlc}.datetime DESC))[1],
+            sum({ohlc}.volume)
+        FROM (
+            SELECT DISTINCT ticker, date_trunc({field}, datetime) AS bucket
+                FROM ({rows}) AS batch
+        ) AS touched
+        JOIN {ohlc}
+            ON {ohlc}.ticker = touched.ticker
+                AND {ohlc}.datetime >= touched.bucket
+                AND {ohlc}.datetime < touched.bucket + {step}
+        GROUP BY {ohlc}.ticker, touched.bucket
+        ON CONFLICT (resolution, ticker, datetime) DO UPDATE
+            SET ({fields}) = ({excluded})
+            WHERE ({current}) IS DISTINCT FROM ({excluded});
+    """).format(
+        rollups=Identifier("ohlc_rollups"),
+        fields=SQL(', ').join(map(Identifier, ROLLUP_FIELDS)),
+        resolution=Literal(resolution),
+        ohlc=Identifier("ohlc"),
+        field=Literal(field),
+        rows=rows,
+        step=SQL("INTERVAL {}").format(Literal(f"1 {field}")),
+        current=SQL(', ').join(Identifier("ohlc_rollups", column) for column in ROLLUP_FIELDS),
+        excluded=SQL(', ').join(Identifier("excluded", column) for column in ROLLUP_FIELDS)
+    )
+
+
+# Change of every ticker of the latest snapshot against its previous bar.
+SNAPSHOT_CHANGES = SQL("""
+    SELECT *,
+        CASE
+            WHEN prev_open IS NOT NULL
+            THEN abs((
+                    (open + close + high + low + volume) -
+                    (prev_open + prev_close + prev_high + prev_low + prev_volume)
+                ) / (
+                    prev_open + prev_close + prev_high + prev_low + prev_volume
+            ))
+            ELSE 0
+        END AS change_ratio,
+        CASE WHEN prev_open IS NOT NULL
+            THEN (open - prev_open)
+            ELSE 0
+        END AS open_delta,
+        CASE WHEN prev_close IS NOT NULL
+            THEN (close - prev_close)
+            ELSE 0
+        END AS close_delta,
+        CASE WHEN prev_high IS NOT NULL
+            THEN (high - prev_high)
+            ELSE 0
+        END AS high_delta,
+        CASE WHEN prev_low IS NOT NULL
+            THEN (low - prev_low)
+            ELSE 0
+        END AS low_delta,
+        CASE WHEN prev_volume IS NOT NULL
+            THEN (volume - prev_volume)
+            ELSE 0
+        END AS volume_delta
+        FROM {snapshots}
+        WHERE datetime = (SELECT MAX(datetime) FROM {snapshots})
+""").format(
+    snapshots=Identifier("ohlc_snapshots")
+)
+
+# Indexes and tables the queries rely on, created on connect when missing.
+SCHEMA_STATEMENTS = [
+    SQL("""
+        CREATE TABLE IF NOT EXISTS {snapshots} (
+            ticker VARCHAR(10) NOT NULL,
+            datetime TIMESTAMP NOT NULL,
+            name VARCHAR(50) NOT NULL,
+            open NUMERIC(10, 2) NOT NULL,
+            high NUMERIC(10, 2) NOT NULL,
+            low NUMERIC(10, 2) NOT NULL,
+            close NUMERIC(10, 2) NOT NULL,
+            volume BIGINT NOT NULL,
+            prev_datetime TIMESTAMP NULL,
+            prev_open NUMERIC(10, 2) NULL,
+            prev_high NUMERIC(10, 2) NULL,
+            prev_low NUMERIC(10, 2) NULL,
+            prev_close NUMERIC(10, 2) NULL,
+            prev_volume BIGINT NULL,
+            PRIMARY KEY (ticker),
+            FOREIGN KEY (ticker) REFERENCES tickers(ticker)
+        );
+    """).format(
+        snapshots=Identifier("ohlc_snapshots")
+    ),
+    SQL("CREATE INDEX IF NOT EXISTS {index} ON {snapshots} (datetime);").format(
+        index=Identifier("ohlc_snapshots_datetime_idx"),
+        snapshots=Identifier("ohlc_snapshots")
+    ),
+    SQL("CREATE INDEX IF NOT EXISTS {index} ON {insights} (datetime);").format(
+        index=Identifier("insights_datetime_idx"),
+        insights=Identifier("insights")
+    ),
+    snapshot_refresh(SQL("SELECT ticker FROM {tickers}").format(tickers=Identifier("tickers"))),
+    SQL("""
+        CREATE TABLE IF NOT EXISTS {rollups} (
+            resolution VARCHAR(10) NOT NULL,
+            ticker VARCHAR(10) NOT NULL,
+            datetime TIMESTAMP NOT NULL,
+            open NUMERIC(10, 2) NOT NULL,
+            high NUMERIC(10, 2) NOT NULL,
+            low NUMERIC(10, 2) NOT NULL,
+            close NUMERIC(10, 2) NOT NULL,
+            volume BIGINT NOT NULL,
+            PRIMARY KEY (resolution, ticker, datetime),
+            FOREIGN KEY (ticker) REFERENCES tickers(ticker)
+        );
+    """).format(
+        rollups=Identifier("ohlc_rollups")
+    ),
+    # Backfill the resolutions which were never rolled up.
+    *(
+        rollup_refresh(
+            resolution,
+            SQL("""
+                SELECT ticker, datetime FROM {ohlc}
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM {rollups} WHERE resolution = {resolution}
+                    )
+            """).format(
+                ohlc=Identifier("ohlc"),
+                rollups=Identifier("ohlc_rollups"),
+                resolution=Literal(resolution)
+            )
+        )
+        for resolution in ROLLUP_RESOLUTIONS
+    ),
+    SQL("""
+        CREATE TABLE IF NOT EXISTS {versions} (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            version BIGINT NOT NULL DEFAULT 0
+        );
+    """).format(
+        versions=Identifier("snapshot_version")
+    ),
+    SQL("INSERT INTO {versions} DEFAULT VALUES ON CONFLICT DO NOTHING;").format(
+        versions=Identifier("snapshot_version")
+    )
+]
+
+
+# Column order of the OHLC rows, which tuple rows are serialized against.
+OHLC_COLUMNS = (
+    "datetime", "timestamp", "ticker", "name",
+    "open", "high", "low", "close", "volume", "source"
+)
+JOINED_OHLC_COLUMNS = (*OHLC_COLUMNS, "stored_company_name")
+# Volumes are read as floats, like the OHLC model has them.
+OHLC_FIELDS = SQL("""
+    {ohlc}.datetime, {ohlc}.timestamp, {ohlc}.ticker, {ohlc}.name,
+    {ohlc}.open, {ohlc}.high, {ohlc}.low, {ohlc}.close,
+    {ohlc}.volume::float8 AS volume, {ohlc}.source
+""").format(
+    ohlc=Identifier("ohlc")
+)
+
+# Hot queries, composed once and prepared on every connection running them.
+# Their shapes are fixed so that a single plan serves every call.
+STATEMENTS = StatementRegistry()
+STATEMENTS.register(
+    "get_tickers",
+    SQL("SELECT {fields} FROM {table}").format(
+        fields=SQL(', ').join(map(Identifier, ["ticker", "name"])),
+        table=Identifier("tickers")
+    )
+)
+STATEMENTS.register(
+    "get_tickers_by_symbols",
+    SQL("SELECT {fields} FROM {table} WHERE ticker = ANY(%s)").format(
+        fields=SQL(', ').join(map(Identifier, ["ticker", "name"])),
+        table=Identifier("tickers")
+    )
+)
+STATEMENTS.register(
+    "get_ticker",
+    SQL("SELECT {fields} FROM {table} WHERE ticker = %s").format(
+        fields=SQL(', ').join(map(Identifier, ["ticker", "name"])),
+        table=Identifier("tickers")
+    )
+)
+STATEMENTS.register(
+    "get_ohlc",
+    SQL("""
+        SELECT {fields}, {ticker}.name AS stored_company_name
+            FROM {ohlc}
+            JOIN {ticker}
+                ON {ticker}.ticker = {ohlc}.ticker;
+    """).format(
+        fields=OHLC_FIELDS,
+        ohlc=Identifier("ohlc"),
+        ticker=Identifier("tickers")
+    )
+)
+# Missing bounds are bound as datetime.min and datetime.max instead of changing the shape.
+STATEMENTS.register(
+    "get_ohlc_history",
+    SQL("""
+        SELECT {fields} FROM {ohlc}
+            WHERE ticker = %s
+                AND datetime >= %s
+                AND datetime <= %s
+                AND datetime < %s
+            ORDER BY datetime DESC
+            LIMIT %s;
+    """).format(
+        fields=OHLC_FIELDS,
+        ohlc=Identifier("ohlc")
+    )
+)
+STATEMENTS.register(
+    "get_candles",
+    SQL("""
+        SELECT datetime, {fields} FROM {rollups}
+            WHERE resolution = %s
+                AND ticker = %s
+                AND datetime >= %s
+                AND datetime <= %s
+            ORDER BY datetime DESC
+            LIMIT %s;
+    """).format(
+        fields=SQL(', ').join(map(Identifier, ROLLUP_FIELDS)),
+        rollups=Identifier("ohlc_rollups")
+    )
+)
+STATEMENTS.register(
+    "get_latest_ohlc",
+    SQL("""
+        SELECT {fields}, {ticker}.name AS stored_company_name
+            FROM {ohlc}
+            JOIN {ticker}
+                ON {ticker}.ticker = {ohlc}.ticker
+            WHERE {ohlc}.datetime = (
+                SELECT MAX(datetime) FROM {snapshots}
+            );
+    """).format(
+        fields=OHLC_FIELDS,
+        ohlc=Identifier("ohlc"),
+        ticker=Identifier("tickers"),
+        snapshots=Identifier("ohlc_snapshots")
+    )
+)
+STATEMENTS.register(
+    "get_latest_ohlc_by_symbols",
+    SQL("""
+        SELECT {fields}, {ticker}.name AS stored_company_name
+            FROM {ohlc}
+            JOIN {ticker}
+                ON {ticker}.ticker = {ohlc}.ticker
+            WHERE {ohlc}.datetime = (
+                SELECT MAX(datetime) FROM {snapshots}
+            )
+                AND {ohlc}.ticker = ANY(%s);
+    """).format(
+        fields=OHLC_FIELDS,
+        ohlc=Identifier("ohlc"),
+        ticker=Identifier("tickers"),
+        snapshots=Identifier("ohlc_snapshots")
+    )
+)
+STATEMENTS.register(
+    "get_insights_input",
+    SQL("""
+        WITH change_calc AS ({changes}), top5 AS
+        (
+            SELECT *
+            FROM change_calc
+            ORDER BY change_ratio DESC
+            LIMIT 5
+        )
+        SELECT
+            datetime, ticker, name,
+            open, high, low, close, volume
+        FROM top5
+        UNION ALL
+        SELECT
+            prev_datetime, ticker, name,
+            prev_open, prev_high, prev_low, prev_close, prev_volume
+        FROM top5
+        WHERE prev_datetime IS NOT NULL
+        ORDER BY datetime DESC;
+    """).format(
+        changes=SNAPSHOT_CHANGES
+    )
+)
+STATEMENTS.register(
+    "get_market_movers",
+    SQL("""
+        WITH change_calc AS ({changes}), top10 AS
+        (
+            SELECT *
+            FROM change_calc
+            ORDER BY change_ratio DESC
+            LIMIT 10
+        )
+        SELECT
+            row_to_json(company.*) AS profile,
+            json_build_object(
+                'open', top10.open,
+                'close', top10.close,
+                'high', top10.high,
+                'low', top10.low,
+                'volume', top10.volume
+            ) AS current_metrics,
+            json_build_object(
+                'open', top10.open_delta,
+                'close', top10.close_delta,
+                'high', top10.high_delta,
+                'low', top10.low_delta,
+                'volume', top10.volume_delta
+            ) AS metric_deltas
+        FROM top10
+        JOIN {company} AS company USING (ticker)
+        ORDER BY top10.change_ratio DESC;
+    """).format(
+        changes=SNAPSHOT_CHANGES,
+        company=Identifier("companies")
+    )
+)
+STATEMENTS.register(
+    "get_ohlc_watermark",
+    SQL("""
+        SELECT
+            (SELECT MAX(datetime) FROM {snapshots}) AS datetime,
+            (SELECT version FROM {versions}) AS version;
+    """).format(
+        snapshots=Identifier("ohlc_snapshots"),
+        versions=Identifier("snapshot_version")
+    )
+)
+STATEMENTS.register(
+    "check_user",
+    SQL("""
+        SELECT 1 FROM users
+            WHERE
+                username = %s
+                OR email = %s
+    """)
+)
+STATEMENTS.register(
+    "create_user",
+    SQL("""
+        INSERT INTO users (email, password, username)
+        VALUES (%s, %s, %s)
+    """)
+)
+STATEMENTS.register(
+    "get_user",
+    SQL("""
+        SELECT * FROM users
+            WHERE username = %s
+    """)
+)
+
+# Statement timeout of the current transaction, in milliseconds.
+SET_STATEMENT_TIMEOUT = SQL("SELECT set_config('statement_timeout', %s, true);")
+# Statement and idle timeouts of the current transaction of a stream, in milliseconds.
+# The server closes the connection of a stream idling longer, releasing its snapshot.
+SET_STREAM_TIMEOUTS = SQL("""
+    SELECT set_config('statement_timeout', %s, true),
+        set_config('idle_in_transaction_session_timeout', %s, true);
+""")
+
+# Version of the snapshot data, bumped by the writes which change it, even at the same datetime.
+# Committed along with the write, so it never runs ahead of the rows it stands for.
+# Serializes the partitioning of ohlc and the creation of its partitions across the workers.
+PARTITIONING_LOCK = SQL("SELECT pg_advisory_xact_lock(hashtext('ohlc_partitioning'));")
+
+BUMP_SNAPSHOT_VERSION = SQL("UPDATE {versions} SET version = version + 1;").format(
+    versions=Identifier("snapshot_version")
+)
+
+# Notification of the listeners of a channel, delivered once the transaction commits.
+NOTIFY = SQL("SELECT pg_notify(%s, %s);")
+
+# Replication lag of a standby in seconds, 0 when it has replayed everything it received.
+# NULL when it is not streaming from the primary, as it would be behind without knowing.
+REPLICATION_LAG = SQL("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming')
+        THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM (now() - pg_last_xact_replay_timestamp()))
+    END AS lag;
+""")
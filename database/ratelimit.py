@@ -0,0 +1,167 @@
+"""Token bucket rate limiting of the API users, per endpoint.
+
+Buckets live in the process by default. With a Redis URL configured,
+the buckets live in Redis instead, shared by every replica.
+"""
+from __future__ import annotations
+from collections import OrderedDict
+import math
+import time
+from typing import NamedTuple
+
+from fastapi import HTTPException, status
+
+from metrics import METRICS
+from utils import logger_factory
+
+try:
+    from redis import asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+
+logger = logger_factory(__name__)
+
+RATE_LIMITED = METRICS.counter(
+    "rate_limited_requests_total", "Requests rejected by the rate limits.", ("endpoint",)
+)
+
+# Refills and takes a token of the bucket in KEYS[1] atomically, on the clock of the server.
+# Returns the seconds to wait for a token as a string, since Redis truncates Lua numbers.
+TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated", tostring(now))
+redis.call("PEXPIRE", KEYS[1], math.ceil(capacity / rate * 1000))
+return tostring(wait)
+"""
+
+
+def available() -> bool:
+    """Check whether redis is installed."""
+    return aioredis is not None
+
+
+class Limit(NamedTuple):
+    """A bucket of `capacity` requests, refilled at `rate` requests per second."""
+    capacity: float
+    rate: float
+
+    @classmethod
+    def parse(cls, spec: str) -> Limit:
+        """Parse a `<requests>/<seconds>` limit, such as `60/60` for 60 requests a minute."""
+        requests, seconds = spec.split("/")
+        return cls(float(requests), float(requests) / float(seconds))
+
+
+def parse_limits(spec: str) -> dict[str, Limit]:
+    """Parse the comma separated `<endpoint>=<requests>/<seconds>` limits."""
+    return {
+        endpoint.strip(): Limit.parse(limit)
+        for endpoint, limit in (item.split("=") for item in spec.split(",") if item.strip())
+    }
+
+
+class MemoryBuckets:
+    """Buckets of this process, keeping the `maxsize` most recently used ones.
+
+    A dropped bucket starts over full, as the bucket of an idle user would.
+    """
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self.buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    def __repr__(self) -> str:
+        return f"<[{self.__class__.__name__}] {len(self.buckets)}/{self.maxsize} buckets>"
+
+    async def take(self, key: str, limit: Limit) -> float:
+        """Take a token of the bucket, returning the seconds to wait for one if it is empty."""
+        now = time.monotonic()
+        tokens, updated = self.buckets.pop(key, (limit.capacity, now))
+        tokens = min(limit.capacity, tokens + (now - updated) * limit.rate)
+        wait = 0.0 if tokens >= 1 else (1 - tokens) / limit.rate
+        self.buckets[key] = (tokens if wait else tokens - 1, now)
+        while len(self.buckets) > self.maxsize:
+            self.buckets.popitem(last=False)
+        return wait
+
+    async def close(self):
+        """Drop the buckets."""
+        self.buckets.clear()
+
+
+class RedisBuckets:
+    """Buckets in Redis, shared by the replicas and expiring once they would be full.
+
+    Requests go through while Redis is unreachable, rather than failing with it.
+    """
+    def __init__(self, url: str, prefix: str = "ratelimit:"):
+        self.prefix = prefix
+        self.client = aioredis.from_url(url)
+        self.script = self.client.register_script(TAKE_SCRIPT)
+
+    def __repr__(self) -> str:
+        return f"<[{self.__class__.__name__}] {self.prefix}*>"
+
+    async def take(self, key: str, limit: Limit) -> float:
+        """Take a token of the bucket, returning the seconds to wait for one if it is empty."""
+        try:
+            return float(await self.script(
+                keys=[f"{self.prefix}{key}"], args=[limit.capacity, limit.rate]
+            ))
+        except aioredis.RedisError as exp:
+            logger.warning("Rate limits are off, Redis failed: %s", exp)
+            return 0.0
+
+    async def close(self):
+        """Close the connections to Redis."""
+        await self.client.aclose()
+
+
+class RateLimiter:
+    """Rate limits the requests of every user to an endpoint with a token bucket.
+
+    Endpoints without a limit of their own get the `default` one,
+    or none if it is None. Internal callers are never limited.
+    """
+    def __init__(
+        self, limits: dict[str, Limit] = None, default: Limit = None,
+        backend: MemoryBuckets | RedisBuckets = None
+    ):
+        self.limits = limits or {}
+        self.default = default
+        self.backend = backend or MemoryBuckets()
+
+    def __repr__(self) -> str:
+        return f"<[{self.__class__.__name__}] {self.backend}>"
+
+    async def check(self, endpoint: str, username: str):
+        """Take a token of the user's bucket for the endpoint, raising a 429 if it is empty."""
+        limit = self.limits.get(endpoint, self.default)
+        if username == "internal" or limit is None:
+            return
+        wait = await self.backend.take(f"{endpoint}:{username}", limit)
+        if wait > 0:
+            RATE_LIMITED.inc(endpoint)
+            logger.info("User %s is rate limited on %s.", username, endpoint)
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests.",
+                headers={"Retry-After": str(math.ceil(wait))}
+            )
+
+    async def close(self):
+        """Close the backend of the buckets."""
+        await self.backend.close()
@@ -0,0 +1,44 @@
+"""Coalescing of concurrent calls for the same key into a single in-flight call."""
+from __future__ import annotations
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+from metrics import METRICS
+
+T = TypeVar("T")
+
+COALESCED_CALLS = METRICS.counter(
+    "singleflight_coalesced_total", "Calls which awaited an in-flight call.", ("flight",)
+)
+
+
+class SingleFlight:
+    """Runs one call per key at a time, which the concurrent callers of the key all await.
+
+    The call runs in its own task, so a caller which gets cancelled, such as
+    the request of a disconnected client, does not cancel it for the others.
+    Its result or exception goes to every caller; nothing is kept once it is done.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.calls: dict[Hashable, asyncio.Task] = {}
+
+    def __repr__(self) -> str:
+        return f"<[{self.__class__.__name__}] {self.name}: {len(self.calls)} in flight>"
+
+    async def run(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """Await the in-flight call of the key, or start one with `func`."""
+        if (task := self.calls.get(key)) is not None:
+            COALESCED_CALLS.inc(self.name)
+        else:
+            task = asyncio.create_task(func())
+            self.calls[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        """Drop the finished call, retrieving its exception in case no caller is left."""
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        if not task.cancelled():
+            task.exception()
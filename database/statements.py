@@ -0,0 +1,61 @@
+"""Registry of the hot queries, which are composed once and prepared server-side.
+
+psycopg prepares a statement on its first execution on a connection, under a name of its own.
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from weakref import WeakSet
+
+if TYPE_CHECKING:
+    from psycopg import AsyncConnection
+    from psycopg.sql import Composed
+
+
+class Statement:
+    """A named query which gets prepared by psycopg on every connection executing it."""
+    def __init__(self, name: str, query: Composed):
+        self.name = name
+        self.query = query
+        self.executions = 0
+        self.prepares = 0
+        self._connections: WeakSet[AsyncConnection] = WeakSet()
+
+    def __repr__(self) -> str:
+        return f"<[{self.__class__.__name__}] {self.name}>"
+
+    def record(self, conn: AsyncConnection):
+        """Count an execution of the statement on a connection.
+
+        The first execution on a connection is the one which prepares it there. This is
+        counted client-side, the plans chosen by Postgres for the executions are not.
+        """
+        self.executions += 1
+        if conn not in self._connections:
+            self._connections.add(conn)
+            self.prepares += 1
+
+
+class StatementRegistry:
+    """Holds the statements by name along with their prepare and execution counts."""
+    def __init__(self):
+        self.statements: dict[str, Statement] = {}
+
+    def __getitem__(self, name: str) -> Statement:
+        return self.statements[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.statements
+
+    def register(self, name: str, query: Composed) -> Statement:
+        """Register a query under a unique name."""
+        if name in self.statements:
+            raise ValueError(f"Statement {name} is already registered.")
+        self.statements[name] = Statement(name, query)
+        return self.statements[name]
+
+    def get_stats(self) -> dict[str, dict[str, int]]:
+        """Get the prepare and execution counts of every statement."""
+        return {
+            name: {"prepares": statement.prepares, "executions": statement.executions}
+            for name, statement in self.statements.items()
+        }
@@ -1,12 +1,22 @@
 # pylint: skip-file
+import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime
+from functools import partial
+import operator
+import os
+from pathlib import Path
 import re
+from typing import AsyncIterator, Callable
 from unittest.mock import AsyncMock, patch
+from uuid import uuid4
 
 from passlib.context import CryptContext
 import psycopg
+from psycopg.conninfo import conninfo_to_dict
 from psycopg.pq import ExecStatus
-from psycopg.sql import Composed, Identifier, SQL
+from psycopg.rows import tuple_row
+from psycopg.sql import Composed, Identifier, Literal, SQL
 import pytest
 
 from database.dbconn import DatabaseConnection
@@ -14,8 +24,17 @@ from database.gpt_client import GptClient
 from database.k8s_authorizer import KubernetesAPI
 
 
+# Hashed once, since every mocked cursor gets a fresh copy of the data.
+TEST_PASSWORD_HASH = CryptContext(schemes=["bcrypt"], deprecated="auto").hash("test")
+# A real Postgres server, for the tests of what the mocked cursors can't compute.
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+INIT_SCRIPT = Path(__file__).parents[1] / "init" / "initdb.sh"
+
+
 def extract_sql(sql: Composed | SQL | Identifier | str) -> list:
     """Extract the SQL query from a Composed object."""
+    if isinstance(sql, Literal):
+        return f"'{sql._obj}'"
     if isinstance(sql, (Identifier, SQL)):
         obj = sql._obj
         if isinstance(obj, tuple):
@@ -24,13 +43,16 @@ def extract_sql(sql: Composed | SQL | Identifier | str) -> list:
     return [extract_sql(elem) for elem in sql]
 
 
+def flatten_sql(elem: list | str) -> str:
+    """Flatten the nested fragments of an extracted SQL query."""
+    if isinstance(elem, list):
+        return ''.join(flatten_sql(sub_elem) for sub_elem in elem)
+    return elem
+
+
 def sql_to_string(sql: Composed) -> str:
     """Convert a SQL query to a string."""
-    combined = ''.join(
-        ''.join(elem)
-        if isinstance(elem, list) else elem
-        for elem in extract_sql(sql)
-    )
+    combined = flatten_sql(extract_sql(sql))
     return ' '.join(
         line.strip()
         for line in combined.split('\n')
@@ -46,8 +68,45 @@ def db_conn() -> type[DatabaseConnection]:
             status = ExecStatus.EMPTY_QUERY
 
 
+        class MockCopy:
+            def __init__(self, table):
+                self.table = table
+                self.types = []
+
+            def set_types(self, types):
+                self.types = types
+
+            async def write_row(self, row):
+                self.table.append(row)
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, exc_type, exc, tb):
+                pass
+
+
+        class MockAdapters:
+            def register_loader(self, oid, loader):
+                pass
+
+
         class MockCursor:
-            def __init__(self):
+            def __init__(self, name=None, row_factory=None, **kwargs):
+                self.name = name
+                self.row_factory = row_factory
+                self.adapters = MockAdapters()
+                self.create_pattern = re.compile(r"CREATE TEMP TABLE (\w+)")
+                self.copy_pattern = re.compile(r"COPY (\w+)")
+                self.merge_pattern = re.compile(
+                    r"INSERT INTO (?P<target>\w+) \((?P<columns>[^)]*)\)\s+"
+                    r"SELECT .*? FROM (?P<staging>\w+)"
+                )
+                self.conflict_pattern = re.compile(r"ON CONFLICT \(([^)]*)\)")
+                self.condition_pattern = re.compile(r"(\w+) (=|>=|<=|<|>) %s")
+                self.order_pattern = re.compile(r"ORDER BY (\w+)")
+                self.any_pattern = re.compile(r"(?:\w+\.)?(\w+) = ANY\(%s\)")
+                self.max_pattern = re.compile(r"SELECT MAX\((\w+)\) AS (\w+) FROM (\w+)")
                 self.table_pattern = re.compile(
                     r"[FIU][RNP][OTD][MOA]T?E?\s{1}(\w+)\s*"
                 )
@@ -97,13 +156,37 @@ def db_conn() -> type[DatabaseConnection]:
                             "source": "yahoo"
                         },
                     ],
+                    'ohlc_rollups': [
+                        {
+                            "resolution": "1day",
+                            "ticker": "AAPL",
+                            "datetime": datetime(2021, 1, 1),
+                            "open": 133.52,
+                            "high": 135.99,
+                            "low": 133.52,
+                            "close": 135.99,
+                            "volume": 140
+                        },
+                        {
+                            "resolution": "1week",
+                            "ticker": "AAPL",
+                            "datetime": datetime(2020, 12, 28),
+                            "open": 133.52,
+                            "high": 135.99,
+                            "low": 133.52,
+                            "close": 135.99,
+                            "volume": 140
+                        }
+                    ],
+                    'pg_partitioned_table': [
+                        {
+                            "partrelid": "ohlc"
+                        }
+                    ],
                     'users': [
                         {
                             "username": "test",
-                            "password": CryptContext(
-                                schemes=["bcrypt"],
-                                deprecated="auto"
-                            ).hash("test"),
+                            "password": TEST_PASSWORD_HASH,
                             "email": "test@test.com"
                         }
                     ],
@@ -152,12 +235,88 @@ def db_conn() -> type[DatabaseConnection]:
                     ]
                 }
                 self.result_cache = []
+                self.rowcount = -1
                 self.pgresult = MockPGResult()
 
             async def execute(self, query, *args, **kwargs):
-                if isinstance(query, Composed):
+                if isinstance(query, (Composed, SQL)):
                     query = sql_to_string(query)
                 self.pgresult.status = ExecStatus.EMPTY_QUERY
+                # Simulate settings, locks and notifications
+                if (
+                    "set_config" in query or "pg_notify" in query
+                    or "pg_advisory_xact_lock" in query or query.startswith("LISTEN")
+                ):
+                    self.pgresult.status = ExecStatus.TUPLES_OK
+                    return True
+                # Simulate the snapshot version and the watermark read along with it
+                if "snapshot_version" in query:
+                    if query.startswith("SELECT"):
+                        self._refresh_snapshots()
+                        self.result_cache.append({
+                            "datetime": max(
+                                (record["datetime"] for record in self.data["ohlc_snapshots"]),
+                                default=None
+                            ),
+                            "version": 0
+                        })
+                        self.pgresult.status = ExecStatus.TUPLES_OK
+                    else:
+                        self.pgresult.status = ExecStatus.COMMAND_OK
+                    return True
+                # Simulate replication lag checks
+                if "pg_last_xact_replay_timestamp" in query:
+                    self.result_cache.append({"lag": 0})
+                    self.pgresult.status = ExecStatus.TUPLES_OK
+                    return True
+                # Simulate aggregates
+                if match := self.max_pattern.search(query):
+                    column, alias, table_name = match.groups()
+                    if table_name == "ohlc_snapshots":
+                        self._refresh_snapshots()
+                    values = [record[column] for record in self.data[table_name]]
+                    self.result_cache.append({alias: max(values, default=None)})
+                    self.pgresult.status = ExecStatus.TUPLES_OK
+                    return True
+                # Simulate staging tables
+                if match := self.create_pattern.search(query):
+                    self.data[match.group(1)] = []
+                    self.pgresult.status = ExecStatus.COMMAND_OK
+                    return True
+                # Simulate DDL statements
+                if query.startswith(("CREATE", "ALTER", "DROP")):
+                    self.pgresult.status = ExecStatus.COMMAND_OK
+                    return True
+                # Simulate the insights input, the latest bars of the tickers
+                if "top5" in query:
+                    self._refresh_snapshots()
+                    self.result_cache.extend(sorted(
+                        (
+                            {key: record[key] for key in (
+                                "datetime", "ticker", "name",
+                                "open", "high", "low", "close", "volume"
+                            )}
+                            for record in self.data["ohlc_snapshots"]
+                        ),
+                        key=lambda record: record["datetime"], reverse=True
+                    )[:5])
+                    self.pgresult.status = ExecStatus.TUPLES_OK
+                    return True
+                # Simulate snapshot refreshes
+                if query.startswith("INSERT INTO ohlc_snapshots"):
+                    self._refresh_snapshots()
+                    self.pgresult.status = ExecStatus.COMMAND_OK
+                    return True
+                # Rollup refreshes are no-ops here, test_rollups runs them on a real Postgres
+                if query.startswith("INSERT INTO ohlc_rollups"):
+                    self.pgresult.status = ExecStatus.COMMAND_OK
+                    return True
+                # Simulate merges from staging tables, test_process_ohlc and
+                # test_insert_companies run the real ones on a real Postgres
+                if (match := self.merge_pattern.search(query)) and not args:
+                    self._handle_merge(match)
+                    self.pgresult.status = ExecStatus.COMMAND_OK
+                    return True
                 table_name = self.table_pattern.search(query).group(1)
                 if table_name not in self.data:
                     raise psycopg.errors.UndefinedTable("Table does not exist.")
@@ -192,6 +351,25 @@ def db_conn() -> type[DatabaseConnection]:
                     # Simulate JOIN queries
                     if match := self.join_pattern.search(query):
                         result = self._handle_join(match)
+                        if any_match := self.any_pattern.search(query):
+                            result = [
+                                record for record in result
+                                if record.get(any_match.group(1)) in args[0][0]
+                            ]
+                        self.result_cache.extend(result)
+                        self.pgresult.status = ExecStatus.TUPLES_OK
+                        return result
+                    # Simulate filtered and limited queries
+                    if "LIMIT" in query:
+                        result = self._handle_filter(table_name, query, args[0])
+                        self.result_cache.extend(result)
+                        self.pgresult.status = ExecStatus.TUPLES_OK
+                        return result
+                    if any_match := self.any_pattern.search(query):
+                        result = [
+                            record for record in self.data[table_name]
+                            if record.get(any_match.group(1)) in args[0][0]
+                        ]
                         self.result_cache.extend(result)
                         self.pgresult.status = ExecStatus.TUPLES_OK
                         return result
@@ -248,6 +426,73 @@ def db_conn() -> type[DatabaseConnection]:
                     for row in zip(*results)
                 ]
 
+            def _handle_filter(self, table_name, query, params):
+                conditions = self.condition_pattern.findall(
+                    query.split("WHERE")[1].split("ORDER BY")[0]
+                )
+                operators = {
+                    "=": operator.eq, ">=": operator.ge, "<=": operator.le,
+                    "<": operator.lt, ">": operator.gt
+                }
+                rows = [
+                    record for record in self.data[table_name]
+                    if all(
+                        operators[op](record.get(column), value)
+                        for (column, op), value in zip(conditions, params)
+                    )
+                ]
+                rows.sort(
+                    key=lambda record: record[self.order_pattern.search(query).group(1)],
+                    reverse="DESC" in query.split("ORDER BY")[1]
+                )
+                return rows[:params[len(conditions)]]
+
+            def _refresh_snapshots(self):
+                snapshots = {}
+                for record in sorted(
+                    self.data["ohlc"], key=lambda record: record["datetime"]
+                ):
+                    previous = snapshots.get(record["ticker"], {})
+                    snapshots[record["ticker"]] = dict(record) | {
+                        f"prev_{key}": previous.get(key)
+                        for key in ("datetime", "open", "high", "low", "close", "volume")
+                    }
+                self.data["ohlc_snapshots"] = list(snapshots.values())
+
+            def _handle_merge(self, match):
+                target, staging = match.group("target"), match.group("staging")
+                columns = [column.strip() for column in match.group("columns").split(",")]
+                key = [
+                    column.strip()
+                    for column in self.conflict_pattern.search(match.string).group(1).split(",")
+                ]
+                rows = [dict(zip(columns, row)) for row in self.data[staging]]
+                tickers = [record.get("ticker") for record in self.data["tickers"]]
+                if "JOIN tickers" in match.string:
+                    rows = [row for row in rows if row["ticker"] in tickers]
+                if any(row["ticker"] not in tickers for row in rows):
+                    raise psycopg.errors.ForeignKeyViolation("Foreign key violation.")
+                existing = {
+                    tuple(record.get(column) for column in key): record
+                    for record in self.data[target]
+                }
+                written = 0
+                for row in rows:
+                    record = existing.get(tuple(row[column] for column in key))
+                    if record is None:
+                        self.data[target].append(row)
+                        written += 1
+                    elif "DO UPDATE" in match.string and record != row:
+                        record |= row
+                        written += 1
+                self.rowcount = written
+
+            def copy(self, query):
+                if isinstance(query, (Composed, SQL)):
+                    query = sql_to_string(query)
+                table_name = self.copy_pattern.search(query).group(1)
+                return MockCopy(self.data[table_name])
+
             def _handle_insert(self, table_name, args):
                 if not args:
                     raise psycopg.errors.SyntaxError("No values provided.")
@@ -283,13 +528,23 @@ def db_conn() -> type[DatabaseConnection]:
                     raise psycopg.errors.UniqueViolation("Unique constraint violation.")
                 return True
 
+            def _make_row(self, row):
+                if self.row_factory is tuple_row and isinstance(row, dict):
+                    return tuple(row.values())
+                return row
+
             async def fetchone(self, *args, **kwargs):
-                return self.result_cache.pop(0)
+                return self._make_row(self.result_cache.pop(0))
 
             async def fetchall(self, *args, **kwargs):
                 cached = self.result_cache
                 self.result_cache = []
-                return cached
+                return [self._make_row(row) for row in cached]
+
+            async def fetchmany(self, size=1, **kwargs):
+                cached = self.result_cache[:size]
+                del self.result_cache[:size]
+                return [self._make_row(row) for row in cached]
 
             async def executemany(self, query, *args, **kwargs):
                 self.pgresult.status = ExecStatus.EMPTY_QUERY
@@ -297,7 +552,7 @@ def db_conn() -> type[DatabaseConnection]:
                     raise psycopg.errors.SyntaxError("No values provided.")
                 if len(args) == 1:
                     return await self.execute(query, args[0], **kwargs)
-                if isinstance(query, Composed):
+                if isinstance(query, (Composed, SQL)):
                     query = sql_to_string(query)
                 table_name = self.table_pattern.search(query).group(1)
                 if table_name in self.data:
@@ -320,8 +575,35 @@ def db_conn() -> type[DatabaseConnection]:
             def __init__(self):
                 self.closed = False
                 self.cursor = MockCursor
+                self.notifications = []
+                self.transaction_owner = None
             async def close(self):
                 self.closed = True
+            async def notifies(self):
+                for channel, payload in self.notifications:
+                    yield psycopg.Notify(channel, payload, 0)
+            @asynccontextmanager
+            async def transaction(self):
+                # A real connection would run the transaction of another task
+                # as a savepoint of the open one, and share its fate.
+                task = asyncio.current_task()
+                if self.transaction_owner not in (None, task):
+                    raise psycopg.errors.ActiveSqlTransaction("Another task is in a transaction.")
+                outer = self.transaction_owner
+                self.transaction_owner = task
+                try:
+                    # BEGIN takes a round trip, where the other tasks may run.
+                    await asyncio.sleep(0)
+                    yield
+                finally:
+                    self.transaction_owner = outer
+            @asynccontextmanager
+            async def pipeline(self):
+                yield
+            async def execute(self, query, *args, **kwargs):
+                cursor = self.cursor()
+                await cursor.execute(query, *args, **kwargs)
+                return cursor
             async def __aenter__(self):
                 return self
             async def __aexit__(self, exc_type, exc, tb):
@@ -330,6 +612,85 @@ def db_conn() -> type[DatabaseConnection]:
         yield DatabaseConnection
 
 
+@pytest.fixture
+def db_pool(db_conn) -> type[DatabaseConnection]:
+    connection = psycopg.AsyncConnection.connect.return_value
+
+    class MockPool:
+        def __init__(self, conninfo, **kwargs):
+            self.kwargs = kwargs
+            self.closed = False
+            self.checkouts = 0
+
+        @staticmethod
+        async def check_connection(conn):
+            pass
+
+        async def open(self, *args, **kwargs):
+            pass
+
+        async def close(self):
+            self.closed = True
+
+        @asynccontextmanager
+        async def connection(self, timeout=None):
+            self.checkouts += 1
+            yield connection
+
+        def get_stats(self):
+            return {
+                "pool_min": self.kwargs["min_size"],
+                "pool_max": self.kwargs["max_size"],
+                "requests_num": self.checkouts
+            }
+
+    with patch('database.dbconn.AsyncConnectionPool', MockPool):
+        yield db_conn
+
+
+def init_schema() -> str:
+    """Extract the tables and the seed data of the init script, without its users and grants."""
+    script = INIT_SCRIPT.read_text().replace("\\$", "$")
+    return script.split("\\c $DB_NAME;", 1)[1].split("GRANT ALL PRIVILEGES", 1)[0]
+
+
+@pytest.fixture
+async def postgres() -> AsyncIterator[Callable[..., DatabaseConnection]]:
+    """Create a scratch database with the init schema on the server at TEST_DATABASE_URL,
+    yielding a factory of the connections to it.
+    """
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set.")
+    params = conninfo_to_dict(TEST_DATABASE_URL)
+    database = f"stocks_test_{uuid4().hex[:8]}"
+    async with await psycopg.AsyncConnection.connect(TEST_DATABASE_URL, autocommit=True) as conn:
+        await conn.execute(
+            SQL("CREATE DATABASE {} ENCODING 'UTF8' TEMPLATE template0").format(
+                Identifier(database)
+            )
+        )
+    try:
+        async with await psycopg.AsyncConnection.connect(
+            TEST_DATABASE_URL, dbname=database, autocommit=True
+        ) as conn:
+            await conn.execute(init_schema())
+        yield partial(
+            DatabaseConnection,
+            params.get("user", "postgres"),
+            params.get("password"),
+            params.get("host", "localhost"),
+            int(params.get("port", 5432)),
+            database
+        )
+    finally:
+        async with await psycopg.AsyncConnection.connect(
+            TEST_DATABASE_URL, autocommit=True
+        ) as conn:
+            await conn.execute(
+                SQL("DROP DATABASE IF EXISTS {} WITH (FORCE)").format(Identifier(database))
+            )
+
+
 @pytest.fixture
 def gpt_client_fixture() -> type[GptClient]:
     with patch.object(
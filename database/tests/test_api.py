@@ -1,5 +1,7 @@
 # pylint: skip-file
+import asyncio
 from datetime import datetime, timedelta
+import json
 import os
 from unittest import mock
 
@@ -7,14 +9,16 @@ from jose import jwt
 from fastapi.testclient import TestClient
 import pytest
 
-from .fixtures import db_conn, gpt_client_fixture, k8s_auth_fixture
+from database.queries import JOINED_OHLC_COLUMNS
+
+from .fixtures import db_conn, db_pool, gpt_client_fixture, k8s_auth_fixture
 
 
 @pytest.fixture
-def client(db_conn, gpt_client_fixture, k8s_auth_fixture):
+def client(db_pool, gpt_client_fixture, k8s_auth_fixture):
     """Create a test client for the FastAPI app."""
     with (
-        mock.patch("dbconn.DatabaseConnection", db_conn) as _,
+        mock.patch("dbconn.DatabaseConnection", db_pool) as _,
         mock.patch("gpt_client.GptClient", gpt_client_fixture) as _,
         mock.patch("k8s_authorizer.KubernetesAPI", k8s_auth_fixture) as _,
     ):
@@ -41,6 +45,25 @@ async def test_get_tickers(client):
     ]}
 
 
+@pytest.mark.parametrize("path, expected", [
+    ("/tickers?symbols=msft,GOOG, MSFT", {"status": 200, "tickers": ["MSFT"]}),
+    ("/tickers?symbols=", {"status": 200, "tickers": []}),
+    ("/latest?symbols=AAPL,MSFT", {"status": 200, "tickers": ["AAPL", "MSFT"]}),
+    ("/latest?symbols=AAPL", {"status": 200, "tickers": ["AAPL"]}),
+    ("/latest?symbols=" + ",".join(f"T{index}" for index in range(101)), {"status": 400}),
+])
+async def test_batch_lookup(client, path, expected):
+    """Test looking up several symbols in a single request."""
+    response = client.get(path, headers={
+        "Authorization": "Bearer blahblah",
+        "X-Internal-Client": "blahblah",
+        "X-Internal-Token": "blahblah"
+    })
+    assert response.status_code == expected["status"]
+    if expected["status"] == 200:
+        assert [item["ticker"] for item in response.json()["items"]] == expected["tickers"]
+
+
 @pytest.mark.parametrize("test_input, expected", [
     ("AAPL", {"ticker": "AAPL", "name": "Apple"}),
     ("GOOG", {'error': 'Ticker not found.'}),
@@ -107,6 +130,112 @@ async def test_get_ohlc(client, valid_token, headers, expected):
 
 
 
+async def test_get_ohlc_stream(client):
+    """Test streaming the GET /ohlc endpoint as NDJSON."""
+    response = client.get("/ohlc", headers={
+        "Accept": "application/x-ndjson",
+        "Authorization": "Bearer blahblah",
+        "X-Internal-Client": "blahblah",
+        "X-Internal-Token": "blahblah"
+    })
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    items = [json.loads(line) for line in response.text.splitlines()]
+    assert [item["ticker"] for item in items] == ["AAPL", "MSFT"]
+    assert items[0]["datetime"] == "2021-01-01T09:30:00"
+    assert items[0]["stored_company_name"] == "Apple"
+
+
+@pytest.mark.parametrize("path, expected", [
+    ("/ohlc", {"tickers": ["AAPL", "MSFT"], "next": None}),
+    ("/ohlc/MSFT?limit=1", {"tickers": ["MSFT"], "next": "2021-01-01T09:30:00"}),
+    ("/latest", {"tickers": ["AAPL", "MSFT"], "next": None})
+])
+async def test_get_ohlc_arrow(client, path, expected):
+    """Test negotiating Arrow IPC streams on the OHLC read endpoints."""
+    pa = pytest.importorskip("pyarrow")
+    headers = {
+        "Accept": "application/vnd.apache.arrow.stream",
+        "Authorization": "Bearer blahblah",
+        "X-Internal-Client": "blahblah",
+        "X-Internal-Token": "blahblah"
+    }
+    response = client.get(path, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/vnd.apache.arrow.stream"
+    assert "Accept" in response.headers["vary"].split(", ")
+    assert response.headers.get("x-next") == expected["next"]
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.column("ticker").to_pylist() == expected["tickers"]
+    assert table.schema.field("datetime").type == pa.timestamp("us")
+    assert table.column("volume").type == pa.float64()
+    with mock.patch("columnar.pa", None):
+        response = client.get(path, headers=headers)
+    assert response.status_code == 406
+
+
+@pytest.mark.parametrize("params, expected", [
+    # First page
+    (
+        {"limit": 1},
+        {"count": 1, "tickers": ["MSFT"], "next": "2021-01-01T09:30:00"}
+    ),
+    # Page after the last record
+    (
+        {"limit": 1, "after": "2021-01-01T09:30:00"},
+        {"count": 0, "tickers": [], "next": None}
+    ),
+    # Date range
+    (
+        {"from": "2021-01-01T00:00:00", "to": "2021-01-02T00:00:00"},
+        {"count": 1, "tickers": ["MSFT"], "next": None}
+    ),
+    # Invalid limit
+    ({"limit": 0}, None)
+])
+async def test_get_ohlc_history(client, params, expected):
+    """Test the GET /ohlc/{ticker} endpoint."""
+    response = client.get("/ohlc/MSFT", params=params, headers={
+        "Authorization": "Bearer blahblah",
+        "X-Internal-Client": "blahblah",
+        "X-Internal-Token": "blahblah"
+    })
+    if expected is None:
+        assert response.status_code == 422
+        return
+    assert response.status_code == 200
+    body = response.json()
+    assert body["count"] == expected["count"]
+    assert [item["ticker"] for item in body["items"]] == expected["tickers"]
+    assert body["next"] == expected["next"]
+
+
+@pytest.mark.parametrize("params, expected", [
+    # Daily candles by default
+    ({}, {"resolution": "1day", "datetimes": ["2021-01-01T00:00:00"]}),
+    # Weekly candles
+    ({"interval": "1week"}, {"resolution": "1week", "datetimes": ["2020-12-28T00:00:00"]}),
+    # Outside of the date range
+    ({"interval": "1week", "from": "2021-01-01T00:00:00"}, {"resolution": "1week", "datetimes": []}),
+    # Unknown interval
+    ({"interval": "1h"}, None)
+])
+async def test_get_candles(client, params, expected):
+    """Test the GET /ohlc/{ticker}/candles endpoint."""
+    response = client.get("/ohlc/AAPL/candles", params=params, headers={
+        "Authorization": "Bearer blahblah",
+        "X-Internal-Client": "blahblah",
+        "X-Internal-Token": "blahblah"
+    })
+    if expected is None:
+        assert response.status_code == 422
+        return
+    assert response.status_code == 200
+    body = response.json()
+    assert body["resolution"] == expected["resolution"]
+    assert [item["datetime"] for item in body["items"]] == expected["datetimes"]
+
+
 @pytest.mark.parametrize("test_input, expected", [
     (
         [{
@@ -123,7 +252,7 @@ async def test_get_ohlc(client, valid_token, headers, expected):
         }],
         201
     ),
-    # Duplicate primary key violation
+    # Duplicate primary key is skipped
     (
         [{
             "datetime": "2021-01-01 09:30:00",
@@ -137,7 +266,7 @@ async def test_get_ohlc(client, valid_token, headers, expected):
             "volume": 100,
             "source": "yahoo"
         }],
-        400
+        201
     ),
     # Foreign key constraint violation
     (
@@ -262,12 +391,18 @@ async def test_post_ohlc(client, test_input, expected):
 ])
 async def test_put_companies(client, test_input, expected):
     """Test the PUT /companies endpoint."""
+    import main
+
+    generation = main.snapshot_cache.generation
     response = client.put("/companies", json=test_input, headers={
         "Authorization": "Bearer blahblah",
         "X-Internal-Client": "blahblah",
         "X-Internal-Token": "blahblah"
     })
     assert response.status_code == expected
+    if expected == 200:
+        # The snapshots carry the company names.
+        assert main.snapshot_cache.generation == generation + (response.json()["inserted"] > 0)
 
 
 @pytest.mark.parametrize("test_input, expected", [
@@ -415,6 +550,67 @@ async def test_insights(client):
     assert response.status_code == 200
 
 
+async def test_insights_conditional_get(client):
+    """Test that the insights are revalidated against the OHLC data they are derived from."""
+    import main
+
+    headers = {
+        "Authorization": "Bearer blahblah",
+        "X-Internal-Client": "blahblah",
+        "X-Internal-Token": "blahblah"
+    }
+    main.snapshot_cache.invalidate()
+    response = client.get("/insights", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["count"] == 1
+    etag = response.headers["etag"]
+    assert client.get("/insights", headers=headers | {"If-None-Match": etag}).status_code == 304
+    with mock.patch.object(
+        main.db_handler, "get_ohlc_watermark",
+        mock.AsyncMock(return_value=(datetime(2021, 1, 2, 9, 30), 1))
+    ):
+        response = client.post("/ohlc", headers=headers, json=[{
+            "datetime": "2021-01-02T09:30:00",
+            "timestamp": 1609579800,
+            "ticker": "AAPL",
+            "name": "Apple Inc.",
+            "open": 100.0,
+            "high": 200.0,
+            "low": 100.0,
+            "close": 200.0,
+            "volume": 100.0,
+            "source": "yahoo"
+        }])
+        assert response.status_code == 201
+        response = client.get("/insights", headers=headers | {"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert response.headers["last-modified"] == "Sat, 02 Jan 2021 09:30:00 GMT"
+    main.snapshot_cache.invalidate()
+
+
+async def test_failed_insights(client):
+    """Test that insights failing on the GPT side are sent without validators."""
+    import main
+
+    headers = {
+        "Authorization": "Bearer blahblah",
+        "X-Internal-Client": "blahblah",
+        "X-Internal-Token": "blahblah"
+    }
+    with (
+        mock.patch.object(main.gpt_client, "last_prompted_datetime", None),
+        mock.patch.object(
+            main.gpt_client, "_send_prompt", mock.AsyncMock(side_effect=RuntimeError("Down."))
+        )
+    ):
+        response = client.get("/insights", headers=headers)
+    assert response.status_code == 200
+    assert response.json() == {"count": 0, "items": []}
+    assert "etag" not in response.headers
+    assert "last-modified" not in response.headers
+
+
 async def test_market_movers(client):
     """Test the GET /movers endpoint."""
     response = client.get("/movers", headers={
@@ -423,3 +619,238 @@ async def test_market_movers(client):
         "X-Internal-Token": "blahblah"
     })
     assert response.status_code == 200
+
+
+async def test_get_metrics(client):
+    """Test the metrics of the API queries, which the API itself doesn't serve."""
+    import main
+    client.get("/tickers")
+    metrics = main.METRICS.render()
+    assert 'db_query_duration_seconds_count{query="get_tickers"}' in metrics
+    assert 'db_query_rows_total{query="get_tickers"}' in metrics
+    assert 'db_statement_executions_total{statement="get_tickers"}' in metrics
+    assert client.get("/metrics").status_code == 404
+
+
+@pytest.mark.parametrize("path", ["/tickers", "/latest", "/movers"])
+async def test_conditional_get(client, path):
+    """Test revalidating the snapshot endpoints against their ETag and Last-Modified."""
+    headers = {
+        "Authorization": "Bearer blahblah",
+        "X-Internal-Client": "blahblah",
+        "X-Internal-Token": "blahblah"
+    }
+    response = client.get(path, headers=headers)
+    assert response.status_code == 200
+    etag, last_modified = response.headers["etag"], response.headers["last-modified"]
+    assert last_modified == "Fri, 01 Jan 2021 09:30:00 GMT"
+    for conditions, expected in (
+        ({"If-None-Match": etag}, 304),
+        ({"If-None-Match": 'W/"0.000000"'}, 200),
+        ({"If-None-Match": 'W/"0.000000"', "If-Modified-Since": last_modified}, 200),
+        ({"If-Modified-Since": last_modified}, 304),
+        ({"If-Modified-Since": "Thu, 31 Dec 2020 09:30:00 GMT"}, 200),
+        # The asctime form and the -0000 zone are UTC too
+        ({"If-Modified-Since": "Fri Jan  1 09:30:00 2021"}, 304),
+        ({"If-Modified-Since": "Thu Dec 31 09:30:00 2020"}, 200),
+        ({"If-Modified-Since": "Fri, 01 Jan 2021 09:30:00 -0000"}, 304),
+        ({"If-Modified-Since": "yesterday"}, 200)
+    ):
+        response = client.get(path, headers=headers | conditions)
+        assert response.status_code == expected
+        assert response.headers["etag"] == etag
+
+
+@pytest.mark.parametrize("path", ["/tickers", "/latest", "/movers"])
+async def test_corrected_snapshots(client, path):
+    """Test that corrections of the snapshot data change the ETag, though not the datetime."""
+    import main
+
+    headers = {
+        "Authorization": "Bearer blahblah",
+        "X-Internal-Client": "blahblah",
+        "X-Internal-Token": "blahblah"
+    }
+    main.snapshot_cache.invalidate()
+    etag = client.get(path, headers=headers).headers["etag"]
+    with mock.patch.object(
+        main.db_handler, "get_ohlc_watermark",
+        mock.AsyncMock(return_value=(datetime(2021, 1, 1, 9, 30), 1))
+    ):
+        main.snapshot_cache.invalidate()
+        response = client.get(path, headers=headers | {"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert response.headers["last-modified"] == "Fri, 01 Jan 2021 09:30:00 GMT"
+    main.snapshot_cache.invalidate()
+
+
+@pytest.mark.parametrize("path, model", [
+    ("/tickers", "TickersResponse"),
+    ("/latest", "OHLCResponse"),
+    ("/movers", "MoversResponse"),
+    ("/ohlc/{ticker}/candles", "CandlesResponse")
+])
+async def test_response_schema(client, path, model):
+    """Test that the endpoints skipping the response models still document them."""
+    schema = client.get("/openapi.json").json()
+    content = schema["paths"][path]["get"]["responses"]["200"]["content"]
+    assert content["application/json"]["schema"] == {"$ref": f"#/components/schemas/{model}"}
+
+
+@pytest.mark.parametrize("path", ["/latest", "/movers"])
+async def test_precompressed_snapshots(client, path):
+    """Test that the snapshot payloads are compressed once, off the event loop,
+    and reused until the next ingestion."""
+    import compression
+    import main
+
+    main.snapshot_cache.invalidate()
+    headers = {
+        "Accept-Encoding": "gzip",
+        "Authorization": "Bearer blahblah",
+        "X-Internal-Client": "blahblah",
+        "X-Internal-Token": "blahblah"
+    }
+    on_loop = []
+
+    def compress(content, encoding):
+        try:
+            on_loop.append(asyncio.get_running_loop() is not None)
+        except RuntimeError:
+            on_loop.append(False)
+        return compression.precompress(content, encoding)
+
+    with (
+        mock.patch("main.COMPRESSION_MIN_SIZE", 0),
+        mock.patch("main.precompress", side_effect=compress) as precompress
+    ):
+        responses = [client.get(path, headers=headers) for _ in range(2)]
+        main.snapshot_cache.invalidate()
+        responses.append(client.get(path, headers=headers))
+    assert precompress.call_count == 2
+    assert on_loop == [False, False]
+    for response in responses:
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.json() == responses[0].json()
+
+
+@pytest.mark.parametrize("path", ["/latest", "/movers"])
+async def test_snapshot_refills(client, path):
+    """Test that the cached snapshots are refilled from the primary, which has every ingestion."""
+    import main
+
+    main.snapshot_cache.invalidate()
+    with (
+        mock.patch.object(main.db_handler, "fetchall", wraps=main.db_handler.fetchall) as fetchall,
+        mock.patch.object(main.db_handler, "fetchone", wraps=main.db_handler.fetchone) as fetchone
+    ):
+        response = client.get(path, headers={
+            "Authorization": "Bearer blahblah",
+            "X-Internal-Client": "blahblah",
+            "X-Internal-Token": "blahblah"
+        })
+    assert response.status_code == 200
+    calls = fetchall.call_args_list + fetchone.call_args_list
+    assert len(calls) == 2
+    assert not any(call.kwargs.get("readonly") for call in calls)
+
+
+def latest_items(client, ticker):
+    """Get the items of a ticker served by /latest."""
+    response = client.get("/latest", headers={
+        "Authorization": "Bearer blahblah",
+        "X-Internal-Client": "blahblah",
+        "X-Internal-Token": "blahblah"
+    })
+    return [item for item in response.json()["items"] if item["ticker"] == ticker]
+
+
+async def test_snapshot_events(client):
+    """Test that ingesting new OHLC data notifies the stream subscribers."""
+    import main
+
+    record = {
+        "datetime": "2021-01-02T09:30:00",
+        "timestamp": 1609545600,
+        "ticker": "AAPL",
+        "name": "Apple Inc.",
+        "open": 100.0,
+        "high": 200.0,
+        "low": 100.0,
+        "close": 200.0,
+        "volume": 100.0,
+        "source": "yahoo"
+    }
+    with main.snapshot_broadcaster.subscribe() as queue:
+        response = client.post("/ohlc", json=[record], headers={
+            "Authorization": "Bearer blahblah",
+            "X-Internal-Client": "blahblah",
+            "X-Internal-Token": "blahblah"
+        })
+        assert response.status_code == 201
+        compact, full = queue.get_nowait()
+    assert compact.startswith(b"id: 2021-01-02T09:30:00\nevent: snapshot\n")
+    data = json.loads(compact.split(b"data: ")[1])
+    assert data == {"datetime": "2021-01-02T09:30:00", "inserted": 1, "tickers": ["AAPL"]}
+    # The rows of the ticker as /latest serves them, not the records as ingested
+    items = json.loads(full.split(b"data: ")[1])["items"]
+    assert items == latest_items(client, "AAPL")
+    assert list(items[0]) == list(JOINED_OHLC_COLUMNS)
+
+
+async def test_followed_ingestions(client):
+    """Test that the ingestions of the other processes notify the stream subscribers,
+    and that the malformed or failing notifications don't stop the listener."""
+    import main
+    from ingestion import INSTANCE_ID
+
+    async def listen(channel):
+        yield json.dumps({"datetime": "2021-01-02T09:30:00", "source": INSTANCE_ID})
+        yield "not json"
+        yield json.dumps({"datetime": "2021-01-02T10:00:00", "tickers": ["AAPL"], "source": "bad"})
+        yield json.dumps({
+            "datetime": "2021-01-02T10:30:00", "inserted": 1,
+            "tickers": ["AAPL"], "source": "consumer"
+        })
+
+    # The announcement of the notification from "bad" fails, the next one goes through.
+    rows = await main.db_handler.get_latest_ohlc(symbols=["AAPL"], readonly=False)
+    with (
+        mock.patch.object(main.db_handler, "listen", listen),
+        mock.patch.object(
+            main.db_handler, "get_latest_ohlc",
+            mock.AsyncMock(side_effect=[RuntimeError("Connection lost."), rows])
+        ),
+        main.snapshot_broadcaster.subscribe() as queue
+    ):
+        await main.follow_ingestions()
+        assert queue.qsize() == 1
+        compact, full = queue.get_nowait()
+    assert compact.startswith(b"id: 2021-01-02T10:30:00\nevent: snapshot\n")
+    data = json.loads(compact.split(b"data: ")[1])
+    assert data == {"datetime": "2021-01-02T10:30:00", "inserted": 1, "tickers": ["AAPL"]}
+    assert json.loads(full.split(b"data: ")[1])["items"] == latest_items(client, "AAPL")
+
+
+async def test_rate_limits(client):
+    """Test that users over the limit of an endpoint get a 429 with Retry-After."""
+    import main
+    from ratelimit import Limit, MemoryBuckets
+
+    headers = {"Authorization": "Bearer blahblah"}
+    internal = headers | {"X-Internal-Client": "blahblah", "X-Internal-Token": "blahblah"}
+    with (
+        mock.patch.object(main.limiter, "limits", {"movers": Limit(1, 0.5)}),
+        mock.patch.object(main.limiter, "backend", MemoryBuckets())
+    ):
+        assert client.get("/movers", headers=internal).status_code == 200
+        assert client.get("/movers", headers=internal).status_code == 200
+        with mock.patch("auth.jwt.decode", return_value={"sub": "test"}):
+            assert client.get("/movers", headers=headers).status_code == 200
+            response = client.get("/movers", headers=headers)
+            assert client.get("/tickers").status_code == 200
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "2"
+    assert response.json() == {"detail": "Too many requests."}
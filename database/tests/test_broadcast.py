@@ -0,0 +1,42 @@
+# pylint: skip-file
+import asyncio
+import json
+
+from database.broadcast import Broadcaster
+
+
+def parse(frame: bytes) -> dict:
+    """Parse the data of a Server-Sent Event."""
+    data = next(line for line in frame.decode().splitlines() if line.startswith("data: "))
+    return json.loads(data.removeprefix("data: "))
+
+
+async def test_fan_out():
+    """Tests that every subscriber gets the events in the form it asked for."""
+    broadcaster = Broadcaster("test_fan_out", heartbeat=0.01)
+    compact, full = broadcaster.stream(), broadcaster.stream(rows=True)
+    assert await anext(compact) == b": subscribed\n\n"
+    assert await anext(full) == b": subscribed\n\n"
+    assert len(broadcaster.subscribers) == 2
+    assert await anext(compact) == b": heartbeat\n\n"
+    broadcaster.publish(
+        "snapshot", {"datetime": "2021-01-02T09:30:00"},
+        rows=[{"ticker": "AAPL"}], event_id="2021-01-02T09:30:00"
+    )
+    frame = await anext(compact)
+    assert frame.startswith(b"id: 2021-01-02T09:30:00\nevent: snapshot\n")
+    assert parse(frame) == {"datetime": "2021-01-02T09:30:00"}
+    assert parse(await anext(full))["items"] == [{"ticker": "AAPL"}]
+    await compact.aclose()
+    await full.aclose()
+    assert not broadcaster.subscribers
+
+
+async def test_backpressure():
+    """Tests that a slow subscriber drops its oldest events without blocking the publisher."""
+    broadcaster = Broadcaster("test_backpressure", maxsize=2)
+    with broadcaster.subscribe() as queue:
+        for index in range(5):
+            broadcaster.publish("snapshot", {"index": index})
+        assert queue.qsize() == 2
+        assert [parse(queue.get_nowait()[0])["index"] for _ in range(2)] == [3, 4]
@@ -0,0 +1,41 @@
+# pylint: skip-file
+from unittest import mock
+
+from database.cache import SnapshotCache
+
+
+async def test_invalidation():
+    """Tests that moving the watermark drops cached and in-flight values."""
+    cache = SnapshotCache("test_invalidation")
+    calls = []
+
+    async def fetch():
+        calls.append(len(calls))
+        return len(calls)
+
+    assert await cache.get_or_set("latest", fetch) == 1
+    assert await cache.get_or_set("latest", fetch) == 1
+    assert cache.get_stats() == {"entries": 1, "hits": 1, "misses": 1}
+
+    async def fetch_during_ingest():
+        cache.invalidate("2021-01-01T09:31:00")
+        return "stale"
+
+    cache.invalidate("2021-01-01T09:30:00")
+    assert await cache.get_or_set("latest", fetch_during_ingest) == "stale"
+    assert cache.watermark == "2021-01-01T09:31:00"
+    assert await cache.get_or_set("latest", fetch) == 2
+
+
+def test_bounds():
+    """Tests that values expire after the TTL and the least recently used are evicted."""
+    cache = SnapshotCache("test_bounds", ttl=10, maxsize=2)
+    with mock.patch("database.cache.time.monotonic", return_value=0):
+        cache.set("latest", 1)
+        cache.set("movers", 2)
+        assert cache.get("latest") == 1
+        cache.set("latest?symbols=AAPL", 3)
+        assert cache.get("movers") is None
+        assert len(cache) == 2
+    with mock.patch("database.cache.time.monotonic", return_value=11):
+        assert cache.get("latest") is None
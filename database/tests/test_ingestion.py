@@ -0,0 +1,51 @@
+# pylint: skip-file
+from datetime import datetime
+import json
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+
+from database.ingestion import INSTANCE_ID, MAX_PAYLOAD_BYTES, ingest_ohlc, parse_event
+
+
+@pytest.mark.parametrize("tickers, listed", [(2, True), (2000, False)])
+async def test_ingestion_events(tickers, listed):
+    """Tests that the events list the ingested tickers as long as they fit a notification."""
+    db_handler = Mock(ohlc_watermark=datetime(2021, 1, 2, 9, 30))
+    db_handler.process_ohlc = AsyncMock(return_value={"inserted": tickers, "skipped": 0})
+    db_handler.notify = AsyncMock(return_value=True)
+    ohlc = [{"ticker": f"T{index:05d}"} for index in range(tickers)]
+    response, event = await ingest_ohlc(db_handler, ohlc)
+    assert response == {"inserted": tickers, "skipped": 0}
+    assert event["tickers"] == ([record["ticker"] for record in ohlc] if listed else None)
+    channel, payload = db_handler.notify.await_args.args
+    assert channel == "ohlc_ingested"
+    assert len(payload.encode()) < MAX_PAYLOAD_BYTES
+    assert json.loads(payload) == {
+        "datetime": "2021-01-02T09:30:00", "inserted": tickers,
+        "tickers": event["tickers"], "source": INSTANCE_ID
+    }
+
+
+@pytest.mark.parametrize("payload, expected", [
+    (
+        '{"datetime": "2021-01-02T09:30:00", "inserted": 1, "tickers": ["AAPL"], "source": "a"}',
+        {"datetime": datetime(2021, 1, 2, 9, 30), "inserted": 1, "tickers": ["AAPL"]}
+    ),
+    (
+        '{"datetime": "2021-01-02T09:30:00", "inserted": 1, "tickers": null}',
+        {"datetime": datetime(2021, 1, 2, 9, 30), "inserted": 1, "tickers": None}
+    ),
+    # Own notifications
+    (json.dumps({"datetime": "2021-01-02T09:30:00", "source": INSTANCE_ID}), None),
+    # Malformed notifications
+    ("not json", None),
+    ("[]", None),
+    ('{"inserted": 1}', None),
+    ('{"datetime": "yesterday"}', None),
+    ('{"datetime": "2021-01-02T09:30:00", "tickers": "AAPL"}', None),
+    ('{"datetime": "2021-01-02T09:30:00", "tickers": [1]}', None)
+])
+def test_parse_event(payload, expected):
+    """Tests parsing the ingestion notifications, skipping the own and the malformed ones."""
+    assert parse_event(payload) == expected
@@ -0,0 +1,68 @@
+# pylint: skip-file
+import asyncio
+
+from database.metrics import CONTENT_TYPE, Counter, Histogram, MetricsRegistry, MetricsServer
+
+
+def test_histogram():
+    """Tests that histogram buckets are cumulative."""
+    histogram = Histogram("latency_seconds", "Latency.", ("query",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe("get_tickers", value=value)
+    assert histogram.samples() == [
+        'latency_seconds_bucket{query="get_tickers",le="0.1"} 1',
+        'latency_seconds_bucket{query="get_tickers",le="1.0"} 2',
+        'latency_seconds_bucket{query="get_tickers",le="+Inf"} 3',
+        'latency_seconds_sum{query="get_tickers"} 5.55',
+        'latency_seconds_count{query="get_tickers"} 3'
+    ]
+
+
+def test_registry():
+    """Tests rendering the registered metrics and their callbacks."""
+    registry = MetricsRegistry()
+    errors = registry.counter("errors_total", "Errors.", ("query",))
+    errors.inc('get_"user"')
+    assert registry.counter("errors_total", "Errors.", ("query",)) is errors
+    registry.gauge("pool", "Pool stats.", ("stat",), callback=lambda: {("pool_max",): 4})
+    assert registry.render() == "\n".join([
+        "# HELP errors_total Errors.",
+        "# TYPE errors_total counter",
+        'errors_total{query="get_\\"user\\""} 1',
+        "# HELP pool Pool stats.",
+        "# TYPE pool gauge",
+        'pool{stat="pool_max"} 4'
+    ]) + "\n"
+    assert isinstance(errors, Counter)
+
+
+async def fetch(port: int, path: str) -> tuple[str, dict[str, str], str]:
+    """Send a GET request to the local port, returning the status line, headers and body."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    response = (await reader.read()).decode()
+    writer.close()
+    head, body = response.split("\r\n\r\n", 1)
+    status, *lines = head.split("\r\n")
+    return status, dict(line.split(": ", 1) for line in lines), body
+
+
+async def test_metrics_server():
+    """Tests serving the metrics on their own port, to one process at a time."""
+    registry = MetricsRegistry()
+    registry.counter("errors_total", "Errors.", ("query",)).inc("get_tickers")
+    server = MetricsServer(registry, host="127.0.0.1", port=0)
+    assert await server.start()
+    port = server.server.sockets[0].getsockname()[1]
+    try:
+        status, headers, body = await fetch(port, "/metrics")
+        assert status == "HTTP/1.1 200 OK"
+        assert headers["Content-Type"] == CONTENT_TYPE
+        assert body == registry.render()
+        status, _, _ = await fetch(port, "/tickers")
+        assert status == "HTTP/1.1 404 Not Found"
+        # Another worker of the same server finds the port taken.
+        assert not await MetricsServer(registry, host="127.0.0.1", port=port).start()
+    finally:
+        await server.close()
+    assert server.server is None
@@ -0,0 +1,112 @@
+# pylint: skip-file
+import asyncio
+import gzip
+
+import pytest
+
+from database.compression import negotiate
+from database.middleware import CancelOnDisconnectMiddleware, CompressionMiddleware
+
+
+async def test_cancel_on_disconnect():
+    """Tests that the request is cancelled once the client disconnects."""
+    cancelled = asyncio.Event()
+
+    async def app(scope, receive, send):
+        await receive()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    messages = [
+        {"type": "http.request", "body": b"", "more_body": False},
+        {"type": "http.disconnect"}
+    ]
+
+    async def receive():
+        await asyncio.sleep(0.01)
+        return messages.pop(0)
+
+    async def send(message):
+        pass
+
+    await CancelOnDisconnectMiddleware(app)({"type": "http", "path": "/movers"}, receive, send)
+    assert cancelled.is_set()
+
+
+async def test_completed_response():
+    """Tests that a completed response is not cancelled by the disconnect that follows."""
+    sent = []
+    completed = asyncio.Event()
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def app(scope, receive, send):
+        await receive()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+        await asyncio.sleep(0.01)
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await completed.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+        if message["type"] == "http.response.body":
+            completed.set()
+
+    await CancelOnDisconnectMiddleware(app)({"type": "http", "path": "/movers"}, receive, send)
+    assert [message["type"] for message in sent] == ["http.response.start", "http.response.body"]
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ("gzip, deflate", "gzip"),
+    ("gzip;q=0, identity", None),
+    ("*;q=0.5", "br"),
+    ("br;q=0.1, gzip;q=0.9", "gzip"),
+    (None, None)
+])
+def test_negotiate(accept_encoding, expected):
+    """Tests picking the encoding with the highest quality."""
+    pytest.importorskip("brotli")
+    assert negotiate(accept_encoding) == expected
+
+
+@pytest.mark.parametrize("headers, chunks, compressed", [
+    # Large body
+    ([], [b"a" * 1000], True),
+    # Small body
+    ([], [b"ok"], False),
+    # Streamed body
+    ([], [b"a", b"b"], True),
+    # Precompressed body
+    ([(b"content-encoding", b"gzip")], [gzip.compress(b"a" * 1000)], False)
+])
+async def test_compression(headers, chunks, compressed):
+    """Tests compressing the responses above the minimum size in the negotiated encoding."""
+    sent = []
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": list(headers)})
+        for index, chunk in enumerate(chunks):
+            await send({
+                "type": "http.response.body", "body": chunk,
+                "more_body": index < len(chunks) - 1
+            })
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "path": "/latest", "headers": [(b"accept-encoding", b"gzip")]}
+    await CompressionMiddleware(app, minimum_size=500)(scope, None, send)
+    start, *bodies = sent
+    body = b"".join(message["body"] for message in bodies)
+    assert (dict(start["headers"]).get(b"content-encoding") == b"gzip") is (compressed or bool(headers))
+    if compressed:
+        assert gzip.decompress(body) == b"".join(chunks)
+    else:
+        assert body == b"".join(chunks)
@@ -0,0 +1,72 @@
+# pylint: skip-file
+import asyncio
+
+from fastapi import HTTPException
+import pytest
+from redis import asyncio as aioredis
+
+from database.ratelimit import Limit, MemoryBuckets, RateLimiter, RedisBuckets, parse_limits
+
+
+def test_parse_limits():
+    """Tests parsing the limits of the endpoints."""
+    assert parse_limits("insights=10/60, movers=2/1") == {
+        "insights": Limit(10, 10 / 60),
+        "movers": Limit(2, 2)
+    }
+    assert parse_limits("") == {}
+
+
+async def test_token_bucket(monkeypatch):
+    """Tests that a bucket allows a burst of its capacity, then refills at its rate."""
+    now = 1000.0
+    monkeypatch.setattr("database.ratelimit.time.monotonic", lambda: now)
+    buckets = MemoryBuckets()
+    limit = Limit(2, 0.5)
+    assert [await buckets.take("movers:test", limit) for _ in range(3)] == [0, 0, 2]
+    now += 1
+    assert await buckets.take("movers:test", limit) == 1
+    now += 1
+    assert await buckets.take("movers:test", limit) == 0
+    assert await buckets.take("movers:other", limit) == 0
+
+
+async def test_redis_buckets(monkeypatch):
+    """Tests the Lua script of the Redis buckets, on the clock of the server."""
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(aioredis, "from_url", lambda url: fakeredis.FakeAsyncRedis(server=server))
+    buckets = RedisBuckets("redis://test")
+    limit = Limit(2, 10)
+    try:
+        assert [await buckets.take("movers:test", limit) for _ in range(2)] == [0, 0]
+        assert 0 < await buckets.take("movers:test", limit) <= 0.1
+        assert await buckets.take("movers:other", limit) == 0
+        assert 0 < await buckets.client.pttl("ratelimit:movers:test") <= 200
+        await asyncio.sleep(0.25)
+        assert [await buckets.take("movers:test", limit) for _ in range(2)] == [0, 0]
+        assert await buckets.take("movers:test", limit) > 0
+        # Requests go through while Redis is down.
+        server.connected = False
+        assert await buckets.take("movers:test", limit) == 0
+    finally:
+        await buckets.close()
+
+
+async def test_rate_limiter():
+    """Tests rejecting the users over the limit of an endpoint, except internal callers."""
+    limiter = RateLimiter({"insights": Limit(1, 0.1)}, backend=MemoryBuckets(maxsize=2))
+    await limiter.check("insights", "test")
+    with pytest.raises(HTTPException) as exc_info:
+        await limiter.check("insights", "test")
+    assert exc_info.value.status_code == 429
+    assert exc_info.value.headers == {"Retry-After": "10"}
+    for _ in range(3):
+        await limiter.check("insights", "internal")
+        await limiter.check("movers", "test")
+    await limiter.check("insights", "other")
+    await limiter.check("insights", "another")
+    # The least recently used bucket was dropped.
+    await limiter.check("insights", "test")
+    assert len(limiter.backend.buckets) == 2
@@ -0,0 +1,49 @@
+# pylint: skip-file
+import asyncio
+
+import pytest
+
+from database.singleflight import SingleFlight
+
+
+async def test_coalescing():
+    """Tests that concurrent callers of a key share one call, and other keys get their own."""
+    flight = SingleFlight("test_coalescing")
+    calls = []
+
+    async def prompt(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return f"insights of {key}"
+
+    results = await asyncio.gather(
+        *(flight.run("09:30", lambda: prompt("09:30")) for _ in range(5)),
+        flight.run("10:30", lambda: prompt("10:30"))
+    )
+    assert calls == ["09:30", "10:30"]
+    assert results == ["insights of 09:30"] * 5 + ["insights of 10:30"]
+    assert not flight.calls
+    await flight.run("09:30", lambda: prompt("09:30"))
+    assert calls == ["09:30", "10:30", "09:30"]
+
+
+async def test_failures():
+    """Tests that errors reach every caller and cancelled callers leave the call running."""
+    flight = SingleFlight("test_failures")
+    release = asyncio.Event()
+
+    async def prompt():
+        await release.wait()
+        raise ValueError("GPT API is down.")
+
+    leader = asyncio.create_task(flight.run("09:30", prompt))
+    follower = asyncio.create_task(flight.run("09:30", prompt))
+    await asyncio.sleep(0)
+    leader.cancel()
+    await asyncio.sleep(0)
+    release.set()
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+    with pytest.raises(ValueError):
+        await follower
+    assert not flight.calls
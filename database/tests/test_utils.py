@@ -0,0 +1,37 @@
+# pylint: skip-file
+from datetime import datetime
+
+import orjson
+import pytest
+
+from database.utils import json_rows, ndjson_rows
+
+COLUMNS = ("datetime", "ticker", "name", "close", "volume")
+ROWS = [
+    (datetime(2021, 1, 1, 9, 30), "AAPL", "Apple Inc.", 133.52, 140),
+    # Values holding commas and quotes are serialized one by one
+    (datetime(2021, 1, 1, 9, 30), "BRK.A", 'Berkshire Hathaway, "Inc."', None, 0)
+]
+
+
+@pytest.mark.parametrize("rows", [[], ROWS[:1], ROWS])
+def test_json_rows(rows):
+    """Tests that the tuple rows serialize as their dicts would."""
+    expected = {"count": len(rows), "items": [dict(zip(COLUMNS, row)) for row in rows]}
+    assert json_rows(COLUMNS, rows) == orjson.dumps(expected)
+    assert json_rows(COLUMNS, rows, next=None) == orjson.dumps(expected | {"next": None})
+
+
+async def test_ndjson_rows():
+    """Tests that the chunks of tuple rows serialize as lines of their dicts."""
+    async def chunks():
+        yield ROWS
+        yield []
+
+    assert [chunk async for chunk in ndjson_rows(COLUMNS, chunks())] == [
+        b"".join(
+            orjson.dumps(dict(zip(COLUMNS, row)), option=orjson.OPT_APPEND_NEWLINE)
+            for row in ROWS
+        ),
+        b""
+    ]
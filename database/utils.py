@@ -1,8 +1,11 @@
 """A module containing utility functions."""
 
-from functools import wraps
+from functools import lru_cache, wraps
 import logging
 import os
+from typing import AsyncIterator
+
+import orjson
 
 
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
@@ -67,3 +70,54 @@ def fetch_password(pwd_name: str, default: str = None) -> str:
 def dedent(string: str) -> str:
     """Dedent a string."""
     return "\n".join([line.strip() for line in string.splitlines()])
+
+
+@lru_cache(maxsize=None)
+def row_template(columns: tuple[str, ...], end: bytes) -> bytes:
+    """Build the template of the JSON objects of the rows, with their keys encoded once."""
+    keys = (orjson.dumps(column).replace(b"%", b"%%") for column in columns)
+    return b"{" + b",".join(key + b":%b" for key in keys) + b"}" + end
+
+
+def encode_rows(
+    columns: tuple[str, ...], rows: list[tuple], end: bytes, out: bytearray
+) -> bytearray:
+    """Append the rows to `out` as JSON objects, each one followed by `end`.
+
+    Every row is serialized as an array in a single call and split on its commas,
+    unless one of its values holds a comma too. The values then fill the template.
+    """
+    template = row_template(columns, end)
+    separators = len(columns) - 1
+    for row in rows:
+        values = orjson.dumps(row)
+        if values.count(b",") == separators:
+            out += template % tuple(values[1:-1].split(b","))
+        else:
+            out += template % tuple(map(orjson.dumps, row))
+    return out
+
+
+def json_rows(columns: tuple[str, ...], rows: list[tuple], **fields) -> bytes:
+    """Serialize tuple rows as the `items` of a JSON response, along with their `count`.
+
+    The rows go straight to JSON bytes, without a dict or a model per row. Against zipping
+    dicts for orjson, 20000 joined OHLC rows take 16.4 ms instead of 15.5 ms, for half
+    the peak memory at 8.6 MiB instead of 17.0 MiB, see benchmarks/bench_rows.py.
+    """
+    out = encode_rows(columns, rows, b",", bytearray(b'{"count":%d,"items":[' % len(rows)))
+    if rows:
+        del out[-1]
+    out += b"]"
+    if fields:
+        out += b"," + orjson.dumps(fields)[1:-1]
+    out += b"}"
+    return bytes(out)
+
+
+async def ndjson_rows(
+    columns: tuple[str, ...], chunks: AsyncIterator[list[tuple]]
+) -> AsyncIterator[bytes]:
+    """Serialize chunks of tuple rows as newline-delimited JSON."""
+    async for rows in chunks:
+        yield bytes(encode_rows(columns, rows, b"\n", bytearray()))